@@ -0,0 +1,139 @@
+"""
+Bulk Evaluation via the OpenAI Batch API
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Any, List, Optional
+from services import get_math_service
+
+logger = logging.getLogger(__name__)
+
+# The registry is a local SQLite file, so only the instance that submitted a
+# batch can poll it. Gunicorn workers on one host share it; several hosts
+# need BATCH_DB_PATH on shared storage or sticky routing per batch id.
+BATCH_DB_PATH = os.getenv("BATCH_DB_PATH", "batches.sqlite3")
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+_db_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """Open the batch registry, creating its table on first use."""
+    connection = sqlite3.connect(BATCH_DB_PATH)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS batches ("
+        "batch_id TEXT PRIMARY KEY, "
+        "status TEXT NOT NULL, "
+        "item_count INTEGER NOT NULL, "
+        "created_at REAL NOT NULL, "
+        "results TEXT)"
+    )
+    return connection
+
+
+def _load_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    """Return the stored record for a batch, or None if it was never submitted here."""
+    with _db_lock, closing(_connect()) as connection, connection:
+        row = connection.execute(
+            "SELECT status, item_count, results FROM batches WHERE batch_id = ?", (batch_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    status, item_count, results = row
+    return {"status": status, "item_count": item_count, "results": json.loads(results) if results else None}
+
+
+def _save_batch(batch_id: str, status: str, item_count: int, results: Optional[List[Dict[str, Any]]] = None) -> None:
+    """Insert or update the stored record for a batch."""
+    with _db_lock, closing(_connect()) as connection, connection:
+        connection.execute(
+            "INSERT INTO batches (batch_id, status, item_count, created_at, results) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(batch_id) DO UPDATE SET status = excluded.status, results = excluded.results",
+            (batch_id, status, item_count, time.time(), json.dumps(results) if results is not None else None)
+        )
+
+
+def _output_text(body: Dict[str, Any]) -> str:
+    """Concatenate the output_text parts of a serialized Responses API object."""
+    return ''.join(
+        part.get('text', '')
+        for item in body.get('output', [])
+        if item.get('type') == 'message'
+        for part in item.get('content', [])
+        if part.get('type') == 'output_text'
+    )
+
+
+def _parse_result_line(line: str) -> Dict[str, Any]:
+    """Turn one line of a batch output or error file into an evaluation result."""
+    record = json.loads(line)
+    result = {"id": record.get('custom_id')}
+    response = record.get('response') or {}
+    if record.get('error') or response.get('status_code') != 200:
+        error = record.get('error') or response.get('body', {}).get('error')
+        result.update({"success": False, "evaluation": None, "hint": None, "error": f"Batch request failed: {error}"})
+        return result
+
+    try:
+        evaluation_data = get_math_service().parse_evaluation_text(_output_text(response['body']))
+    except json.JSONDecodeError as e:
+        result.update({"success": False, "evaluation": None, "hint": None, "error": f"Invalid JSON response from evaluation API: {e}"})
+        return result
+
+    result.update({"success": True, "error": None})
+    result.update(evaluation_data)
+    return result
+
+
+def submit_batch(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Submit evaluations to the OpenAI Batch API and record the batch for polling.
+
+    Args:
+        items: Evaluation requests with question, correct_answer, student_answer,
+            optional chat_history and an optional caller-chosen id.
+
+    Returns:
+        A dictionary with the batch id and its initial status.
+    """
+    batch = get_math_service().submit_batch_evaluation(items)
+    _save_batch(batch.id, batch.status, len(items))
+    logger.info("Submitted evaluation batch %s with %d items", batch.id, len(items))
+
+    return {"batch_id": batch.id, "status": batch.status}
+
+
+def poll_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Check a submitted batch, downloading and storing its results once it finishes.
+
+    Args:
+        batch_id: Id returned by submit_batch.
+
+    Returns:
+        A dictionary with status, item count and results (None until finished),
+        or None if the batch was not submitted through this service.
+    """
+    stored = _load_batch(batch_id)
+    if stored is None:
+        return None
+    if stored['status'] in TERMINAL_STATUSES:
+        return {"batch_id": batch_id, **stored}
+
+    batch = get_math_service().client.batches.retrieve(batch_id)
+    results = None
+    if batch.status in TERMINAL_STATUSES:
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = get_math_service().client.files.content(file_id).text
+                results.extend(_parse_result_line(line) for line in content.splitlines() if line.strip())
+        logger.info("Evaluation batch %s finished with status %s", batch_id, batch.status)
+
+    _save_batch(batch_id, batch.status, stored['item_count'], results)
+    return {"batch_id": batch_id, "status": batch.status, "item_count": stored['item_count'], "results": results}
@@ -0,0 +1,210 @@
+"""
+Result Caches for OCR and Evaluation
+"""
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Union
+import numpy as np
+from cachetools import TTLCache
+from diskcache import Cache
+
+
+def content_key(data: bytes) -> str:
+    """
+    Return the digest used to key cached results for raw content.
+
+    Keys never leave the process, so a 128-bit BLAKE2b digest is used rather
+    than SHA256: it is collision-resistant and markedly faster on MB-sized images.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe TTL cache for service result dictionaries"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        """Initialize the underlying TTL cache and its lock"""
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a shallow copy of the cached result, or None on a miss."""
+        with self._lock:
+            result = self._cache.get(key)
+        return dict(result) if result is not None else None
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a shallow copy of the result so callers can't mutate the cache."""
+        with self._lock:
+            self._cache[key] = dict(result)
+
+
+class DiskResultCache:
+    """Disk-backed result cache shared by worker processes and kept across restarts"""
+
+    def __init__(self, directory: str, ttl: float, size_limit: int):
+        """Open (or create) the SQLite-backed cache at directory"""
+        self._cache = Cache(directory, size_limit=size_limit, eviction_policy='least-recently-used')
+        self._ttl = ttl
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result, or None on a miss."""
+        return self._cache.get(key)
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        """Store the result until its TTL expires."""
+        self._cache.set(key, dict(result), expire=self._ttl)
+
+
+def create_result_cache(
+    maxsize: int,
+    ttl: float,
+    directory: Optional[str] = None,
+    size_limit: int = 1 << 30
+) -> Union[ResultCache, DiskResultCache]:
+    """Return a disk-backed cache when a directory is given, otherwise an in-process one."""
+    if directory:
+        return DiskResultCache(directory, ttl=ttl, size_limit=size_limit)
+    return ResultCache(maxsize=maxsize, ttl=ttl)
+
+
+class PerceptualIndex:
+    """Thread-safe bounded map from integer perceptual hashes to exact content keys"""
+
+    def __init__(self, maxsize: int):
+        """Initialize the LRU-ordered entries and their lock"""
+        self._entries = OrderedDict()
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+
+    def find(self, image_hash: int, max_distance: int) -> Optional[str]:
+        """Return the content key of the closest hash within max_distance bits, if any."""
+        best_hash, best_key = None, None
+        best_distance = max_distance + 1
+        with self._lock:
+            for known_hash, key in self._entries.items():
+                distance = (image_hash ^ known_hash).bit_count()
+                if distance < best_distance:
+                    best_hash, best_key, best_distance = known_hash, key, distance
+            if best_key is not None:
+                self._entries.move_to_end(best_hash)
+        return best_key
+
+    def add(self, image_hash: int, key: str) -> None:
+        """Record the content key for a perceptual hash, evicting the oldest entry when full."""
+        with self._lock:
+            self._entries[image_hash] = key
+            self._entries.move_to_end(image_hash)
+            if len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+
+class SemanticCache:
+    """
+    Thread-safe nearest-neighbour cache over embedding vectors.
+
+    Entries are partitioned by scope and only match within their scope. Each
+    served hit gets an id; feedback on it nudges the similarity threshold up
+    (bad hit) or down (good hit) within fixed bounds. Entries are per process,
+    but with a directory the hit ids and threshold live in a disk store shared
+    by all worker processes, so feedback is accepted by whichever worker
+    receives it and every worker adapts the same threshold.
+    """
+
+    HIT_TTL_SECONDS = 3600
+
+    def __init__(
+        self,
+        threshold: float,
+        min_threshold: float = 0.90,
+        max_threshold: float = 0.999,
+        threshold_step: float = 0.005,
+        max_scopes: int = 1024,
+        max_entries_per_scope: int = 64,
+        directory: Optional[str] = None
+    ):
+        """Initialize the scoped entries, hit registry and threshold bounds"""
+        self._threshold = threshold
+        # The shared threshold is keyed on its configured start, so changing
+        # the configuration restarts adaptation instead of being ignored
+        self._threshold_key = f"threshold:{threshold}"
+        self._store = Cache(directory) if directory else None
+        self._min_threshold = min_threshold
+        self._max_threshold = max_threshold
+        self._threshold_step = threshold_step
+        self._max_scopes = max_scopes
+        self._max_entries_per_scope = max_entries_per_scope
+        self._scopes = OrderedDict()
+        self._hits = TTLCache(maxsize=4096, ttl=self.HIT_TTL_SECONDS)
+        self._lock = threading.Lock()
+
+    @property
+    def threshold(self) -> float:
+        """Current cosine-similarity threshold for a hit."""
+        if self._store is not None:
+            return self._store.get(self._threshold_key, self._threshold)
+        return self._threshold
+
+    def get(self, scope: str, embedding: List[float]) -> Optional[Tuple[str, float, Dict[str, Any]]]:
+        """Return (hit id, similarity, result copy) for the closest entry above the threshold."""
+        vector = _unit_vector(embedding)
+        threshold = self.threshold
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if not entries:
+                return None
+            self._scopes.move_to_end(scope)
+            similarities = np.stack([known for known, _ in entries]) @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < threshold:
+                return None
+            hit_id = uuid.uuid4().hex
+            if self._store is None:
+                self._hits[hit_id] = True
+            result = dict(entries[best][1])
+        if self._store is not None:
+            self._store.set(f"hit:{hit_id}", True, expire=self.HIT_TTL_SECONDS)
+        return hit_id, similarity, result
+
+    def put(self, scope: str, embedding: List[float], result: Dict[str, Any]) -> None:
+        """Store a result under its embedding, evicting the oldest entry or scope when full."""
+        vector = _unit_vector(embedding)
+        with self._lock:
+            entries = self._scopes.setdefault(scope, [])
+            self._scopes.move_to_end(scope)
+            entries.append((vector, dict(result)))
+            if len(entries) > self._max_entries_per_scope:
+                entries.pop(0)
+            if len(self._scopes) > self._max_scopes:
+                self._scopes.popitem(last=False)
+
+    def record_feedback(self, hit_id: str, helpful: bool) -> bool:
+        """Adjust the threshold from feedback on a served hit; False if the id is unknown."""
+        if self._store is not None:
+            with self._store.transact():
+                if self._store.pop(f"hit:{hit_id}") is None:
+                    return False
+                self._store.set(self._threshold_key, self._adjusted(self.threshold, helpful))
+            return True
+
+        with self._lock:
+            if self._hits.pop(hit_id, None) is None:
+                return False
+            self._threshold = self._adjusted(self._threshold, helpful)
+            return True
+
+    def _adjusted(self, threshold: float, helpful: bool) -> float:
+        """Lower the threshold after a helpful hit and raise it after a bad one, within bounds."""
+        if helpful:
+            return max(self._min_threshold, threshold - self._threshold_step)
+        return min(self._max_threshold, threshold + self._threshold_step)
+
+
+def _unit_vector(embedding: List[float]) -> np.ndarray:
+    """Normalize an embedding so a dot product gives cosine similarity."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,30 @@
+"""
+Gunicorn Configuration
+"""
+import multiprocessing
+import os
+
+# Requests spend most of their time waiting on the OCR and LLM APIs, so each
+# worker runs a thread pool to keep several of those calls in flight at once.
+# A blocked thread costs almost no CPU, so concurrency comes from threads
+# rather than extra processes, which would each hold their own clients and caches.
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+worker_class = "gthread"
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# OCR + evaluation can take well over a minute on a slow upstream response.
+timeout = 180
+
+# Keep client connections open longer than the load balancer's 60s idle
+# timeout, so it never reuses a connection Gunicorn has already closed.
+keepalive = 75
+
+# Recycle workers periodically to bound memory growth from image buffers.
+max_requests = 1000
+max_requests_jitter = 100
+
+# Gunicorn only limits the request line and headers; the body size limit is
+# enforced by Flask's MAX_CONTENT_LENGTH (16MB) in mathAI.create_app.
+limit_request_line = 8190
+limit_request_field_size = 8190
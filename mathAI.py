@@ -3,43 +3,257 @@ Math Evaluation Flask Application
 """
 
 import os
-import base64
+import atexit
 import logging
+import logging.handlers
 import io
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from werkzeug.utils import secure_filename
-from services import math_service, validation_service
+import time
+import queue
+from dataclasses import dataclass
+from functools import lru_cache, wraps
+from concurrent.futures import ThreadPoolExecutor, wait
+import orjson
+from flask import Flask, Request, Response, request, jsonify, make_response, stream_with_context, current_app
+from flask.json.provider import JSONProvider
+from werkzeug.middleware.proxy_fix import ProxyFix
+from cache import ResultCache, content_key
+from services import FULL_EVALUATION_DEADLINE_SECONDS, get_math_service, validation_service
+from batch import submit_batch, poll_batch
 
-# Configure logging
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Process-wide configuration read once from environment variables"""
+    cors_origins: frozenset
+    host: str
+    port: int
+    debug: bool
+    access_log: bool
+    batch_max_concurrency: int
+    proxy_hops: int
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build the settings on first use and reuse them afterwards."""
+    cors_origins = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000,null')
+    return Settings(
+        cors_origins=frozenset(origin.strip() for origin in cors_origins.split(',')),
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 5000)),
+        debug=os.environ.get('FLASK_ENV') == 'development',
+        access_log=os.environ.get('ACCESS_LOG') == '1',
+        batch_max_concurrency=int(os.environ.get('BATCH_MAX_CONCURRENCY', 10)),
+        proxy_hops=int(os.environ.get('PROXY_HOPS', 1))
+    )
+
+# Configure logging: request threads only enqueue records, and a background
+# listener formats and writes them so stream I/O stays off the request path.
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    handlers=[_log_queue_handler],
+    force=True
 )
 logger = logging.getLogger(__name__)
 
+# Per-request access logs are emitted at DEBUG unless ACCESS_LOG=1
+ACCESS_LOG_LEVEL = logging.INFO if get_settings().access_log else logging.DEBUG
+
+# Batch evaluations fan out on this pool; its size caps how many batch LLM
+# calls a worker has in flight, keeping bursts under the OpenAI rate limits.
+BATCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=get_settings().batch_max_concurrency,
+    thread_name_prefix='batch'
+)
+
+# Successful evaluation responses are replayed verbatim for retried POSTs,
+# keyed on the client's Idempotency-Key header when one is sent.
+IDEMPOTENCY_CACHE_MAX_ENTRIES = 2048
+IDEMPOTENCY_CACHE_TTL_SECONDS = 300
+response_cache = ResultCache(maxsize=IDEMPOTENCY_CACHE_MAX_ENTRIES, ttl=IDEMPOTENCY_CACHE_TTL_SECONDS)
+
+# Fixed error bodies are serialized once at import. Each request still gets a
+# fresh Response around them, since after_request handlers add headers to it.
+NO_JSON_ERROR = orjson.dumps({"success": False, "error": "No JSON data provided"})
+NO_IMAGE_FILE_ERROR = orjson.dumps({"success": False, "error": "No image file provided in the 'image' field."})
+NO_IMAGE_SELECTED_ERROR = orjson.dumps({"success": False, "error": "No image file selected."})
+UNKNOWN_BATCH_ERROR = orjson.dumps({"success": False, "error": "Unknown batch id"})
+BAD_REQUEST_ERROR = orjson.dumps({"success": False, "error": "Bad request. Please check your input data and format."})
+NOT_FOUND_ERROR = orjson.dumps({"success": False, "error": "This endpoint does not exist."})
+IDEMPOTENCY_KEY_REUSED_ERROR = orjson.dumps({"success": False, "error": "Idempotency-Key was already used with a different request body."})
+
+# Streamed evaluations must reach the client as they are produced, so disable
+# caching and reverse-proxy buffering for them.
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# CORS headers are fixed for the life of the process, so build them once.
+# Browsers may reuse a preflight result for CORS_MAX_AGE seconds.
+CORS_MAX_AGE = 600
+CORS_PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, Idempotency-Key',
+    'Access-Control-Max-Age': str(CORS_MAX_AGE)
+}
+
+class InMemoryUploadRequest(Request):
+    """Request that keeps multipart file parts in memory instead of spooling them to disk"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        """Return an in-memory stream; MAX_CONTENT_LENGTH already bounds the whole body."""
+        return io.BytesIO()
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson for request parsing and response bodies"""
+
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a JSON string."""
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """Deserialize JSON from str or bytes."""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Build a JSON response from the encoded bytes without a str round trip."""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+def _queue_bulk_evaluation(data):
+    """Validate bulk evaluation items and submit them to the Batch API, answering 202."""
+    validation = validation_service.validate_batch_evaluation_request(
+        data, max_items=validation_service.MAX_BULK_ITEMS
+    )
+    if not validation['valid']:
+        return jsonify({"success": False, "error": validation['error']}), 400
+
+    result = submit_batch(data['items'])
+    return jsonify({"success": True, **result}), 202
+
+def _static_error(body: bytes, status: int) -> Response:
+    """Wrap a pre-serialized error body in a new JSON response."""
+    return Response(body, status=status, mimetype='application/json')
+
+def _oversized_body_response():
+    """Return a 413 response when the declared body exceeds MAX_CONTENT_LENGTH, otherwise None."""
+    max_content_length = current_app.config['MAX_CONTENT_LENGTH']
+    if request.content_length is not None and request.content_length > max_content_length:
+        return jsonify({"success": False, "error": f"File too large. Maximum size is {max_content_length // 1024 // 1024}MB."}), 413
+    return None
+
+def _sse_event(name: str, payload) -> bytes:
+    """Encode one Server-Sent Event with a JSON data line."""
+    return b"event: " + name.encode('utf-8') + b"\ndata: " + orjson.dumps(payload) + b"\n\n"
+
+def _request_body_key() -> str:
+    """
+    Digest the request body, scoped to the path.
+
+    Multipart forms are digested by their fields and file contents, since the
+    boundary differs on every send. Other bodies are digested raw; the view
+    then reads the cached copy, so the body is only received once.
+    """
+    if request.mimetype == 'multipart/form-data':
+        parts = [request.path, sorted(request.form.items(multi=True))]
+        for name, upload in request.files.items(multi=True):
+            parts.append([name, content_key(upload.stream.read())])
+            upload.stream.seek(0)
+        return content_key(orjson.dumps(parts))
+    return content_key(request.path.encode('utf-8') + b"\n" + request.get_data(cache=True))
+
+def _idempotent(key_from_body: bool = False):
+    """
+    Replay a cached 200 response for retried requests.
+
+    Requests are keyed on their Idempotency-Key header, scoped to the path and
+    the client (its Authorization header, or its address without one), so a
+    guessed key never returns another client's response. The body digest is
+    stored with the response, and a key reused with a different body is
+    rejected with 422. Without the header, key_from_body falls back to a digest
+    of the raw request body; otherwise the request is not cached. Responses
+    carry X-Cache: HIT or MISS.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            idempotency_key = request.headers.get('Idempotency-Key')
+            cache_key = body_key = None
+            if idempotency_key or key_from_body:
+                body_key = _request_body_key()
+            if idempotency_key:
+                client = request.headers.get('Authorization') or request.remote_addr or ''
+                cache_key = content_key(f"{request.path}\n{client}\n{idempotency_key}".encode('utf-8'))
+            elif key_from_body:
+                cache_key = body_key
+
+            cached = response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                if cached['body_key'] != body_key:
+                    return _static_error(IDEMPOTENCY_KEY_REUSED_ERROR, 422)
+                response = app.response_class(cached['body'], status=cached['status'], mimetype=cached['mimetype'])
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if cache_key and response.status_code == 200:
+                response_cache.set(cache_key, {
+                    "body": response.get_data(),
+                    "body_key": body_key,
+                    "status": response.status_code,
+                    "mimetype": response.mimetype
+                })
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+def _register_cors(app, allowed_origins):
+    """Answer preflights directly and add CORS headers for allowed origins."""
+
+    @app.before_request
+    def handle_cors_preflight():
+        """Short-circuit OPTIONS requests before routing and request logging."""
+        if request.method == 'OPTIONS':
+            return Response(status=204)
+        return None
+
+    @app.after_request
+    def add_cors_headers(response):
+        """Echo an allowed Origin back with credential support."""
+        origin = request.headers.get('Origin')
+        if origin in allowed_origins:
+            response.headers['Access-Control-Allow-Origin'] = origin
+            response.headers['Access-Control-Allow-Credentials'] = 'true'
+            response.headers['Access-Control-Expose-Headers'] = 'X-Cache'
+            if request.method == 'OPTIONS':
+                response.headers.update(CORS_PREFLIGHT_HEADERS)
+        response.vary.add('Origin')
+        return response
+
 def create_app():
     """Application factory pattern"""
     app = Flask(__name__)
-    
-    # Configuration from environment variables for better security and flexibility
-    cors_origins = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000,null').split(',')
+    app.request_class = InMemoryUploadRequest
+    app.json = OrjsonProvider(app)
     
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['MAX_IMAGE_SIZE'] = 10 * 1024 * 1024  # 10MB max decoded base64 image
     app.config['JSON_SORT_KEYS'] = False
-    app.config['UPLOAD_FOLDER'] = 'uploads'
-
-    # Create upload folder if it doesn't exist
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     # Enable CORS with configured origins
-    CORS(   
-        app,
-        origins=cors_origins,
-        methods=["GET", "POST", "OPTIONS"],
-        allow_headers=["Content-Type", "Authorization"],
-        supports_credentials=True
-    )
+    _register_cors(app, get_settings().cors_origins)
+
+    # Behind the load balancer, remote_addr is the proxy's address; take the
+    # client's from X-Forwarded-For so idempotency keys stay scoped per client.
+    # Set PROXY_HOPS=0 when serving directly, or clients could spoof the header.
+    proxy_hops = get_settings().proxy_hops
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
     
     return app
 
@@ -65,20 +279,34 @@ def health_check():
 def extract_text():
     """Extract text from a base64 encoded image string."""
     try:
-        data = request.get_json()
+        oversized = _oversized_body_response()
+        if oversized is not None:
+            return oversized
+
+        data = request.get_json(cache=False)
         if not data:
-            return jsonify({"success": False, "error": "No JSON data provided"}), 400
+            return _static_error(NO_JSON_ERROR, 400)
         
+        # Reject oversized images from the base64 length alone, before any decoding
+        image_data = data.get('image')
+        if isinstance(image_data, str):
+            max_image_size = app.config['MAX_IMAGE_SIZE']
+            if validation_service.estimate_decoded_size(image_data) > max_image_size:
+                return jsonify({"success": False, "error": f"Image too large. Maximum size is {max_image_size // 1024 // 1024}MB."}), 413
+
         # Validate and clean base64 image data
-        image_validation = validation_service.validate_image_data(data.get('image'))
+        image_validation = validation_service.validate_image_data(image_data)
         if not image_validation['valid']:
             return jsonify({"success": False, "error": image_validation['error']}), 400
-        
-        # The service expects a file-like object, so we decode the base64 string
-        image_bytes = base64.b64decode(image_validation['cleaned_data'])
-        image_file = io.BytesIO(image_bytes)
 
-        result = math_service.extract_text_from_image(image_file)
+        # Check the format from the leading bytes before any OCR work starts
+        decoded = image_validation['decoded']
+        signature_validation = validation_service.validate_image_signature(decoded)
+        if not signature_validation['valid']:
+            return jsonify({"success": False, "error": signature_validation['error']}), 400
+        
+        # The service expects a file-like object, so wrap the decoded bytes
+        result = get_math_service().extract_text_from_image(io.BytesIO(decoded))
         
         return jsonify(result), 200 if result.get('success') else 500
         
@@ -90,12 +318,13 @@ def extract_text():
         return jsonify({"success": False, "error": "An internal server error occurred during OCR."}), 500
 
 @app.route('/api/evaluate', methods=['POST'])
+@_idempotent(key_from_body=True)
 def evaluate_solution():
     """Evaluate a math solution provided as text."""
     try:
-        data = request.get_json()
+        data = request.get_json(cache=False)
         if not data:
-            return jsonify({"success": False, "error": "No JSON data provided"}), 400
+            return _static_error(NO_JSON_ERROR, 400)
         
         # Validate required text fields
         validation = validation_service.validate_evaluation_request(data)
@@ -103,7 +332,7 @@ def evaluate_solution():
             return jsonify({"success": False, "error": validation['error']}), 400
         histo = data.get('chat_history', '')
         step_count = data.get('nextStepCount', 0)
-        result = math_service.evaluate_math_solution(
+        result = get_math_service().evaluate_math_solution(
             question=data['question'],
             correct_answer=data['correct_answer'],
             student_work=data['student_answer'],
@@ -117,17 +346,145 @@ def evaluate_solution():
         logger.error("Evaluation endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": "An internal server error occurred during evaluation."}), 500
 
+@app.route('/api/evaluate_stream', methods=['POST'])
+def evaluate_solution_stream():
+    """Evaluate a math solution provided as text, streaming the output as Server-Sent Events."""
+    try:
+        data = request.get_json(cache=False)
+        if not data:
+            return _static_error(NO_JSON_ERROR, 400)
+
+        validation = validation_service.validate_evaluation_request(data)
+        if not validation['valid']:
+            return jsonify({"success": False, "error": validation['error']}), 400
+
+        events = get_math_service().stream_math_solution(
+            question=data['question'],
+            correct_answer=data['correct_answer'],
+            student_work=data['student_answer'],
+            step_count=data.get('nextStepCount', 0),
+            prev_history=data.get('chat_history', '')
+        )
+        return Response(
+            stream_with_context(_sse_event(name, payload) for name, payload in events),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS
+        )
+
+    except Exception as e:
+        logger.error("Streaming evaluation endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": "An internal server error occurred during evaluation."}), 500
+
+@app.route('/api/evaluate_batch', methods=['POST'])
+def evaluate_batch():
+    """
+    Evaluate several text solutions concurrently, returning results in request order.
+
+    With "deferred": true the items are queued on the OpenAI Batch API instead,
+    exactly as /api/evaluate_bulk does.
+    """
+    try:
+        data = request.get_json(cache=False)
+        if not data:
+            return _static_error(NO_JSON_ERROR, 400)
+
+        if data.get('deferred') is True:
+            return _queue_bulk_evaluation(data)
+
+        validation = validation_service.validate_batch_evaluation_request(data)
+        if not validation['valid']:
+            return jsonify({"success": False, "error": validation['error']}), 400
+
+        futures = [
+            BATCH_EXECUTOR.submit(
+                get_math_service().evaluate_math_solution,
+                question=item['question'],
+                correct_answer=item['correct_answer'],
+                student_work=item['student_answer'],
+                step_count=item.get('nextStepCount', 0),
+                prev_history=item.get('chat_history', '')
+            )
+            for item in data['items']
+        ]
+        results = [future.result() for future in futures]
+        success = all(result.get('success') for result in results)
+
+        return jsonify({"success": success, "results": results}), 200 if success else 500
+
+    except Exception as e:
+        logger.error("Batch evaluation endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": "An internal server error occurred during batch evaluation."}), 500
+
+@app.route('/api/evaluate_bulk', methods=['POST'])
+def evaluate_bulk():
+    """Queue text solutions for offline grading through the OpenAI Batch API."""
+    try:
+        data = request.get_json(cache=False)
+        if not data:
+            return _static_error(NO_JSON_ERROR, 400)
+
+        return _queue_bulk_evaluation(data)
+
+    except Exception as e:
+        logger.error("Bulk evaluation endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": "An internal server error occurred while submitting the bulk evaluation."}), 500
+
+@app.route('/api/evaluate_bulk/<batch_id>', methods=['GET'])
+def evaluate_bulk_status(batch_id):
+    """Report the status of a bulk evaluation, with its results once finished."""
+    try:
+        result = poll_batch(batch_id)
+        if result is None:
+            return _static_error(UNKNOWN_BATCH_ERROR, 404)
+        return jsonify({"success": True, **result}), 200
+
+    except Exception as e:
+        logger.error("Bulk evaluation status endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": "An internal server error occurred while checking the bulk evaluation."}), 500
+
+@app.route('/api/feedback', methods=['POST'])
+def semantic_cache_feedback():
+    """Record whether an evaluation served from the semantic cache was appropriate."""
+    try:
+        data = request.get_json(cache=False)
+        if not data:
+            return _static_error(NO_JSON_ERROR, 400)
+
+        validation = validation_service.validate_feedback_request(data)
+        if not validation['valid']:
+            return jsonify({"success": False, "error": validation['error']}), 400
+
+        result = get_math_service().record_semantic_feedback(data['id'], data['helpful'])
+        return jsonify(result), 200 if result.get('success') else 404
+
+    except Exception as e:
+        logger.error("Feedback endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": "An internal server error occurred while recording feedback."}), 500
+
 @app.route('/api/full_evaluation', methods=['POST'])
+@_idempotent()
 def full_evaluation():
     """Perform OCR and evaluation from an uploaded image file."""
+    deadline = time.perf_counter() + FULL_EVALUATION_DEADLINE_SECONDS
     try:
+        oversized = _oversized_body_response()
+        if oversized is not None:
+            return oversized
+
         # 1. Validate request parts
         if 'image' not in request.files:
-            return jsonify({"success": False, "error": "No image file provided in the 'image' field."}), 400
+            return _static_error(NO_IMAGE_FILE_ERROR, 400)
 
         image_file = request.files['image']
         if image_file.filename == '':
-            return jsonify({"success": False, "error": "No image file selected."}), 400
+            return _static_error(NO_IMAGE_SELECTED_ERROR, 400)
+
+        # Reject non-images from their leading bytes before any OCR work starts
+        header = image_file.stream.read(validation_service.IMAGE_SIGNATURE_LENGTH)
+        image_file.stream.seek(0)
+        signature_validation = validation_service.validate_image_signature(header)
+        if not signature_validation['valid']:
+            return jsonify({"success": False, "error": signature_validation['error']}), 400
 
         question = request.form.get('question')
         correct_answer = request.form.get('correct_answer')
@@ -136,23 +493,18 @@ def full_evaluation():
         if not all([question, correct_answer]):
             return jsonify({"success": False, "error": "Missing required form fields: question, correct_answer."}), 400
 
-        # 2. Securely save the file to a temporary location
-        filename = secure_filename(image_file.filename)
-        temp_image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image_file.save(temp_image_path)
         histo = request.form.get('chat_history', '[]')
-        # 3. Process the file using the service
-        result = math_service.process_full_evaluation(
-            image_data=temp_image_path,
+
+        # 2. Transcribe and evaluate only once the form is known to be valid,
+        # so a rejected request never waits on a billed OCR call
+        result = get_math_service().process_full_evaluation(
+            image_data=image_file.stream,
             question=question,
             correct_answer=correct_answer,
             step_count=step_count,
-            prev_history = histo 
+            prev_history = histo,
+            deadline=deadline
         )
-        
-        # 4. Clean up the temporary file
-        os.remove(temp_image_path)
-        # print(result)
 
         return jsonify(result), 200 if result.get('success') else 500
 
@@ -160,17 +512,75 @@ def full_evaluation():
         logger.error("Full evaluation endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": "An internal server error occurred."}), 500
 
+@app.route('/api/full_evaluation_batch', methods=['POST'])
+@_idempotent()
+def full_evaluation_batch():
+    """
+    Perform OCR and evaluation for several uploaded images concurrently, returning results in request order.
+
+    The form carries one 'images' file per item and an 'items' field holding a
+    JSON list of objects with the /api/full_evaluation form fields.
+    """
+    deadline = time.perf_counter() + FULL_EVALUATION_DEADLINE_SECONDS
+    try:
+        oversized = _oversized_body_response()
+        if oversized is not None:
+            return oversized
+
+        images = request.files.getlist('images')
+        try:
+            items = orjson.loads(request.form.get('items', ''))
+        except orjson.JSONDecodeError:
+            return jsonify({"success": False, "error": "Field 'items' must be a non-empty JSON list"}), 400
+
+        validation = validation_service.validate_full_evaluation_batch_request(items, len(images))
+        if not validation['valid']:
+            return jsonify({"success": False, "error": validation['error']}), 400
+
+        # Reject non-images from their leading bytes before any OCR work starts
+        for index, image_file in enumerate(images):
+            header = image_file.stream.read(validation_service.IMAGE_SIGNATURE_LENGTH)
+            image_file.stream.seek(0)
+            signature_validation = validation_service.validate_image_signature(header)
+            if not signature_validation['valid']:
+                return jsonify({"success": False, "error": f"Image {index}: {signature_validation['error']}"}), 400
+
+        # Every item shares the request's deadline, so items still queued on the
+        # pool when it passes fail fast instead of outliving the worker timeout
+        futures = [
+            BATCH_EXECUTOR.submit(
+                get_math_service().process_full_evaluation,
+                image_data=image_file.stream,
+                question=item['question'],
+                correct_answer=item['correct_answer'],
+                step_count=int(item.get('currentStepCount', 0)),
+                prev_history=item.get('chat_history', '[]'),
+                deadline=deadline
+            )
+            for image_file, item in zip(images, items)
+        ]
+        # The upload streams are closed when the request ends, so let every item finish with them first
+        wait(futures)
+        results = [future.result() for future in futures]
+        success = all(result.get('success') for result in results)
+
+        return jsonify({"success": success, "results": results}), 200 if success else 500
+
+    except Exception as e:
+        logger.error("Batch full evaluation endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": "An internal server error occurred during batch evaluation."}), 500
+
 # --- Error Handlers ---
 
 @app.errorhandler(400)
 def bad_request(error):
     """Handle bad request errors."""
-    return jsonify({"success": False, "error": "Bad request. Please check your input data and format."}), 400
+    return _static_error(BAD_REQUEST_ERROR, 400)
 
 @app.errorhandler(404)
 def not_found(error):
     """Handle not found errors for undefined routes."""
-    return jsonify({"success": False, "error": "This endpoint does not exist."}), 404
+    return _static_error(NOT_FOUND_ERROR, 404)
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
@@ -189,15 +599,14 @@ def internal_server_error(error):
 def log_request():
     """Log incoming requests, skipping health checks for cleaner logs."""
     if request.endpoint != 'health_check':
-        logger.info("Request: %s %s from %s", request.method, request.path, request.remote_addr)
+        logger.log(ACCESS_LOG_LEVEL, "Request: %s %s from %s", request.method, request.path, request.remote_addr)
 
 # --- Main Application Runner ---
 
 def main():
     """Main application entry point."""
-    port = int(os.environ.get('PORT', 5000))
-    debug = os.environ.get('FLASK_ENV') == 'development'
-    host = os.environ.get('HOST', '0.0.0.0')
+    settings = get_settings()
+    host, port, debug = settings.host, settings.port, settings.debug
     
     # Pre-flight check for required environment variables
     if not os.environ.get('OPENAI_API_KEY'):
@@ -208,8 +617,13 @@ def main():
     logger.info("Debug mode: %s", 'On' if debug else 'Off')
     
     try:
-        # Use app.run() for development. For production, use a WSGI server like Gunicorn or Waitress.
-        app.run(host=host, port=port, debug=debug)
+        if debug:
+            # The Werkzeug server is single-process and only suitable for development.
+            app.run(host=host, port=port, debug=debug)
+        else:
+            # Hand the process over to Gunicorn so signals reach its arbiter directly.
+            config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn_conf.py')
+            os.execvp('gunicorn', ['gunicorn', '-c', config_path, 'mathAI:app'])
     except Exception as e:
         logger.critical("Failed to start application: %s", e, exc_info=True)
 
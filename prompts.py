@@ -15,14 +15,7 @@ Boundaries: Do not give hints or solutions unless the student makes a mistake. N
 
 ### Never use — in the response.
 
-### Formatting: Always reply in strict JSON format:
-{
-"evaluation": "Step-by-step evaluation of the student's answer. This should be strictly in markdown formats",
-"hint": "The hint to continue OR 'Your answer is correct. This should be strictly in markdown formats'"
-"verdict": "correct" | "on track" | "incorrect"
-}
-
-Your need to follow the following styles to setup the markdown format:
+### Formatting: The "evaluation" and "hint" fields must strictly use markdown. Follow these styles to set up the markdown format:
 
 ### MANDATORY MARKDOWN FORMATTING RULES
 ### Math Expression Rules
@@ -0,0 +1,81 @@
+"""
+Client-side Rate Limiting for OpenAI Calls
+"""
+import threading
+import time
+from typing import Mapping, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the token count of text at four characters per token."""
+    return len(text) // 4 + 1
+
+
+class _Bucket:
+    """Token bucket refilled continuously at capacity-per-minute"""
+
+    def __init__(self, capacity: Optional[float]):
+        """Start full, or unlimited when capacity is None"""
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """Add the capacity accrued since the last refill, up to the full capacity."""
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available; zero when it already is."""
+        if self.capacity is None or self.level >= min(amount, self.capacity):
+            return 0.0
+        return (min(amount, self.capacity) - self.level) * 60.0 / self.capacity
+
+
+class RateLimiter:
+    """
+    Thread-safe requests-per-minute and tokens-per-minute limiter.
+
+    Callers block in acquire() until both buckets can cover the request, so
+    bursts are smoothed locally instead of being rejected upstream with a 429
+    and retried after a backoff. Limits start from the configured values, or
+    unlimited, and are corrected from each response's x-ratelimit-* headers.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        """Initialize both buckets and their condition variable"""
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens: int) -> None:
+        """Block until one request and tokens are available, then consume them."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._requests.refill(now)
+                self._tokens.refill(now)
+                delay = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                if delay == 0.0:
+                    break
+                self._condition.wait(delay)
+            if self._requests.capacity is not None:
+                self._requests.level -= 1
+            if self._tokens.capacity is not None:
+                self._tokens.level -= min(tokens, self._tokens.capacity)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Adopt the limits and remaining budget reported by the API."""
+        with self._condition:
+            now = time.monotonic()
+            for bucket, kind in ((self._requests, 'requests'), (self._tokens, 'tokens')):
+                limit = headers.get(f'x-ratelimit-limit-{kind}')
+                remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+                if limit is None or remaining is None:
+                    continue
+                bucket.refill(now)
+                bucket.capacity = float(limit)
+                bucket.level = min(float(remaining), bucket.level if bucket.level is not None else float(remaining))
+                bucket.updated = now
+            self._condition.notify_all()
@@ -0,0 +1,84 @@
+"""
+Model Routing for Evaluations
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROUTE_EXACT = "exact"
+ROUTE_LIGHT = "light"
+ROUTE_FULL = "full"
+
+# Served without any model call when the student's answer is the expected answer.
+EXACT_MATCH_EVALUATION = {
+    "evaluation": (
+        "## Current Step Analysis\n\nYour answer matches the expected answer. **Excellent job!**\n\n"
+        "## Final Check\n\nSubstitute your answer back into the original problem to verify your solution."
+    ),
+    "hint": "Your answer is correct",
+    "verdict": "correct"
+}
+
+
+def _compact(text: Any) -> str:
+    """Drop all whitespace so '2x = 4' and '2x=4' compare equal; numbers compare as text.
+
+    Case is kept, since it can change a math answer (x vs X, p vs P).
+    """
+    return ''.join(str(text).split())
+
+
+class EvaluationRouter:
+    """
+    Pick the cheapest evaluation tier that can handle a student's answer.
+
+    An answer equal to the expected answer (ignoring whitespace) is
+    accepted without a model call. When an embedding function is configured,
+    an answer whose cosine similarity to the expected answer is below
+    light_threshold is far off track and goes to the light model for a short
+    hint. Everything else, including any embedding failure, uses the full model.
+    Near-identical embeddings are never treated as correct: "x = 3" and
+    "x = 4" embed almost identically.
+    """
+
+    def __init__(
+        self,
+        embed: Optional[Callable[[List[str]], Optional[List[List[float]]]]] = None,
+        light_threshold: float = 0.3
+    ):
+        """Initialize the routing tiers and decision counters"""
+        self._embed = embed
+        self._light_threshold = light_threshold
+        self._counts = {ROUTE_EXACT: 0, ROUTE_LIGHT: 0, ROUTE_FULL: 0}
+        self._lock = threading.Lock()
+
+    def route(self, student_work: Any, correct_answer: Any) -> str:
+        """Return ROUTE_EXACT, ROUTE_LIGHT or ROUTE_FULL for an answer."""
+        decision = ROUTE_FULL
+        if _compact(student_work) == _compact(correct_answer):
+            decision = ROUTE_EXACT
+        elif self._embed is not None:
+            embeddings = self._embed([str(student_work), str(correct_answer)])
+            if embeddings:
+                student, expected = (np.asarray(vector, dtype=np.float32) for vector in embeddings)
+                norm = np.linalg.norm(student) * np.linalg.norm(expected)
+                similarity = float(student @ expected / norm) if norm else 0.0
+                if similarity < self._light_threshold:
+                    decision = ROUTE_LIGHT
+        self._record(decision)
+        return decision
+
+    def counts(self) -> Dict[str, int]:
+        """Return how many evaluations each tier has served."""
+        with self._lock:
+            return dict(self._counts)
+
+    def _record(self, decision: str) -> None:
+        """Count a routing decision and log the running distribution for threshold tuning."""
+        with self._lock:
+            self._counts[decision] += 1
+            counts = dict(self._counts)
+        logger.info("Evaluation routed to %s tier (totals %s)", decision, counts)
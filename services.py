@@ -2,29 +2,284 @@
 Math Evaluation Services
 """
 import os
+import atexit
 import json
 import logging
 import time
-import base64
-from typing import Dict, Any
+import io
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import httpx
+import imagehash
+import orjson
+import pytesseract
 from dotenv import load_dotenv
 from google import genai
-from openai import OpenAI
+from google.genai import types
+from openai import DefaultHttpxClient, OpenAI
 from PIL import Image
 from prompts import eval_prompt, ocr_prompt
+from ratelimit import RateLimiter, estimate_tokens
+from router import EvaluationRouter, EXACT_MATCH_EVALUATION, ROUTE_EXACT, ROUTE_LIGHT
+from cache import PerceptualIndex, SemanticCache, content_key, create_result_cache
+
+# Prefer the SIMD-accelerated decoder; the stdlib module is API compatible.
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+__all__ = [
+    "FULL_EVALUATION_DEADLINE_SECONDS",
+    "FUSED_OCR_EVALUATION",
+    "MathEvaluationService",
+    "ValidationService",
+    "get_math_service",
+    "validation_service",
+]
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging, unless the importing application already has
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
 logger = logging.getLogger(__name__)
 
 # Define constants for model names to avoid magic strings
 GEMINI_FLASH_MODEL = "gemini-2.0-flash"
 GPT_NANO_MODEL = "gpt-5-mini"
+GPT_LIGHT_MODEL = "gpt-5-nano"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Output caps bound both cost and tail latency. The evaluation cap includes the
+# model's reasoning tokens; tune both from the token usage logged per call.
+EVAL_MAX_OUTPUT_TOKENS = int(os.getenv("EVAL_MAX_OUTPUT_TOKENS", "2048"))
+OCR_MAX_OUTPUT_TOKENS = int(os.getenv("OCR_MAX_OUTPUT_TOKENS", "1024"))
+
+# Long sessions would otherwise grow every prompt linearly; only the newest
+# steps of the history, up to this many tokens, are sent for context.
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "2000"))
+
+# Optional single-call path for /api/full_evaluation: the evaluation model reads
+# the image itself, saving the separate Gemini round trip. It is off by default
+# because transcription quality then depends on the evaluation model; on any
+# failure the two-stage OCR + evaluation path is used instead.
+FUSED_OCR_EVALUATION = os.getenv("FUSED_OCR_EVALUATION", "0") == "1"
+FUSED_STUDENT_WORK = "The handwritten work in the attached image. Transcribe it into extracted_text first."
+
+# Structured output schema for evaluations. With strict mode the model can only
+# emit this object, so replies never arrive wrapped in prose or malformed.
+EVALUATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "name": "evaluation",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "evaluation": {
+                "type": "string",
+                "description": "Step-by-step evaluation of the student's answer, in markdown."
+            },
+            "hint": {
+                "type": "string",
+                "description": "The hint to continue, or 'Your answer is correct', in markdown."
+            },
+            "verdict": {"type": "string", "enum": ["correct", "on track", "incorrect"]}
+        },
+        "required": ["evaluation", "hint", "verdict"],
+        "additionalProperties": False
+    }
+}
+
+# The fused OCR + evaluation call also returns its transcription of the image
+EVALUATION_WITH_TRANSCRIPTION_FORMAT = {
+    **EVALUATION_RESPONSE_FORMAT,
+    "name": "evaluation_with_transcription",
+    "schema": {
+        **EVALUATION_RESPONSE_FORMAT["schema"],
+        "properties": {
+            "extracted_text": {
+                "type": "string",
+                "description": "Exact transcription of the handwritten work in the image."
+            },
+            **EVALUATION_RESPONSE_FORMAT["schema"]["properties"]
+        },
+        "required": ["extracted_text", *EVALUATION_RESPONSE_FORMAT["schema"]["required"]]
+    }
+}
+
+# User messages and model settings of every evaluation request. The problem
+# message is the same for each step of a problem; the step message varies.
+EVAL_PROBLEM_TEMPLATE = "Question: {question}\nCorrect Answer: {correct_answer}\n"
+EVAL_STEP_TEMPLATE = (
+    "Students previous steps (Ignore if this answers is wrong): {history}\n, Dont judge this step. Check this only when necessary"
+    "Student's Current Answer: {student_work}\n, Evaluate this step only."
+)
+EVAL_VERBOSITY = "low"
+EVAL_REASONING_EFFORT = "low"
+
+# Each OpenAI attempt fails after OPENAI_TIMEOUT_SECONDS without a response, and
+# the SDK waits at most 60 s (a Retry-After it honours) before its one retry, so
+# a single call holds a thread for at most 30 + 60 + 30 = 120 s. Gemini calls
+# time out after GEMINI_TIMEOUT_SECONDS and are not retried by the SDK.
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = 5.0
+OPENAI_RETRY_AFTER_MAX_SECONDS = 60.0
+OPENAI_CALL_MAX_SECONDS = (
+    OPENAI_TIMEOUT_SECONDS * (1 + OPENAI_MAX_RETRIES) + OPENAI_RETRY_AFTER_MAX_SECONDS * OPENAI_MAX_RETRIES
+)
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+
+# A full evaluation chains OCR, evaluation and possibly a fused-call fallback,
+# which together could outlast Gunicorn's 180 s timeout and get the worker
+# killed with every request on it. Each call after the first gets only the
+# time left of this budget, so a stalled upstream returns the JSON error.
+FULL_EVALUATION_DEADLINE_SECONDS = float(os.getenv("FULL_EVALUATION_DEADLINE_SECONDS", "150"))
+
+# The SDK applies its own timeout to every request, overriding the HTTP client's,
+# so this is passed to OpenAI() rather than to openai_http_client.
+OPENAI_TIMEOUT = httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+# One pooled HTTP/2 connection set serves every OpenAI call in the process, so
+# requests reuse warm TLS connections instead of paying a handshake each time.
+openai_http_client = DefaultHttpxClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200, keepalive_expiry=30)
+)
+atexit.register(openai_http_client.close)
+
+# Evaluation calls wait locally for request and token budget rather than
+# drawing 429s. Limits come from OPENAI_RPM_LIMIT / OPENAI_TPM_LIMIT when set
+# and are then tracked from the x-ratelimit-* headers of every response. Each
+# Gunicorn worker keeps its own buckets, so divide configured limits by the
+# worker count; the header sync already reflects organisation-wide usage.
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "0")) or None
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "0")) or None
+# The system prompt is constant, so its share of every estimate is computed once.
+EVAL_PROMPT_TOKENS = estimate_tokens(eval_prompt)
+# Upper estimate for one image downscaled to OCR_MAX_EDGE_PX
+IMAGE_INPUT_TOKEN_ESTIMATE = 1500
+openai_rate_limiter = RateLimiter(requests_per_minute=OPENAI_RPM_LIMIT, tokens_per_minute=OPENAI_TPM_LIMIT)
+
+# Per-provider caps on in-flight calls from one worker. Threads beyond the cap
+# queue here instead of piling extra concurrent requests onto a slow upstream.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+openai_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
+# Batch API jobs complete within 24 hours at half the synchronous token price
+# and draw on a separate rate-limit pool, so bulk grading never slows live tutoring.
+BATCH_ENDPOINT = "/v1/responses"
+BATCH_COMPLETION_WINDOW = "24h"
+
+# When CACHE_DIR is set, OCR and evaluation results are persisted there so all
+# Gunicorn workers share them and they survive worker recycling and restarts.
+# Keys carry a digest of the model and prompt settings, so entries never go
+# stale on a deploy and can be kept for weeks to avoid reprocessing uploads.
+CACHE_DIR = os.getenv("CACHE_DIR")
+CACHE_SIZE_LIMIT_BYTES = int(os.getenv("CACHE_SIZE_LIMIT_BYTES", str(5 << 30)))
+
+def _cache_directory(name: str):
+    """Return the on-disk location for a named cache, or None to keep it in memory."""
+    return os.path.join(CACHE_DIR, name) if CACHE_DIR else None
+
+# OCR results are keyed on a digest of the raw image bytes: identical bytes
+# always yield the identical transcription, so entries only expire via TTL.
+# Failed extractions are never cached so transient API errors can be retried.
+OCR_CACHE_MAX_ENTRIES = 1024
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+ocr_cache = create_result_cache(
+    maxsize=OCR_CACHE_MAX_ENTRIES,
+    ttl=OCR_CACHE_TTL_SECONDS,
+    directory=_cache_directory("ocr"),
+    size_limit=CACHE_SIZE_LIMIT_BYTES
+)
+
+# Images are downscaled and re-encoded before upload: vision tokens scale with
+# pixel dimensions, and phone photos are far larger than handwriting needs.
+OCR_MAX_EDGE_PX = int(os.getenv("OCR_MAX_EDGE_PX", "1024"))
+OCR_JPEG_QUALITY = 85
+OCR_PASSTHROUGH_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+# Optional cheaper Gemini model tried before GEMINI_FLASH_MODEL. It is asked to
+# mark illegible parts, and its text is only kept when it is long enough, has
+# no such marker and is mostly ASCII; anything else escalates to the full model.
+OCR_CHEAP_MODEL = os.getenv("OCR_CHEAP_MODEL", "")
+OCR_CHEAP_MIN_CHARS = int(os.getenv("OCR_CHEAP_MIN_CHARS", "3"))
+OCR_CHEAP_MAX_NON_ASCII_RATIO = float(os.getenv("OCR_CHEAP_MAX_NON_ASCII_RATIO", "0.3"))
+OCR_UNCERTAIN_MARKER = "[?]"
+OCR_CHEAP_PROMPT = f"{ocr_prompt}\nWrite {OCR_UNCERTAIN_MARKER} in place of anything you cannot read with confidence."
+
+# Optional second-level OCR lookup for re-encoded or re-taken photos of the same
+# work. It is off by default: two handwritten steps on the same page can hash
+# within a few bits of each other, and a false match returns the wrong text.
+OCR_PERCEPTUAL_CACHE = os.getenv("OCR_PERCEPTUAL_CACHE", "0") == "1"
+OCR_PERCEPTUAL_MAX_DISTANCE = int(os.getenv("OCR_PERCEPTUAL_MAX_DISTANCE", "4"))
+ocr_perceptual_index = PerceptualIndex(maxsize=OCR_CACHE_MAX_ENTRIES)
+
+# Optional local Tesseract pass ahead of Gemini. Its text is only used when every
+# recognized word clears the confidence threshold; anything else escalates.
+LOCAL_OCR_FIRST = os.getenv("LOCAL_OCR_FIRST", "0") == "1"
+LOCAL_OCR_MIN_CONFIDENCE = float(os.getenv("LOCAL_OCR_MIN_CONFIDENCE", "70"))
+_ocr_tier_counts = {"local": 0, "cheap": 0, "escalated": 0}
+_ocr_tier_lock = threading.Lock()
+
+# Every setting that can change a transcription is folded into the OCR cache
+# key: models, prompts, upload encoding and the local and perceptual tiers.
+# Switching any of them never serves stale text, so entries can live for weeks.
+OCR_CACHE_VERSION = content_key(
+    json.dumps([
+        GEMINI_FLASH_MODEL, ocr_prompt, OCR_MAX_EDGE_PX, OCR_JPEG_QUALITY, OCR_MAX_OUTPUT_TOKENS,
+        OCR_CHEAP_MODEL, OCR_CHEAP_PROMPT, OCR_CHEAP_MIN_CHARS, OCR_CHEAP_MAX_NON_ASCII_RATIO,
+        OCR_PERCEPTUAL_CACHE, OCR_PERCEPTUAL_MAX_DISTANCE, LOCAL_OCR_FIRST, LOCAL_OCR_MIN_CONFIDENCE
+    ]).encode('utf-8')
+)[:12]
+
+# Optional semantic evaluation cache: a step whose embedding is close enough to
+# an already-evaluated step of the same question reuses that evaluation. It is
+# off by default because answers such as "x = 3" and "x = 4" embed almost
+# identically; the threshold adapts to feedback posted to /api/feedback. With
+# CACHE_DIR the hit ids and threshold are shared by all workers; without it,
+# feedback only reaches the worker that served the hit.
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD, directory=_cache_directory("semantic"))
+
+# Answers identical to the expected answer never reach a model. Optionally,
+# answers whose embedding is far from the expected answer are sent to the
+# light model for a short hint; it is off by default as it adds an embedding
+# call to every other evaluation.
+EVAL_ROUTER_LIGHT_MODEL = os.getenv("EVAL_ROUTER_LIGHT_MODEL", "0") == "1"
+EVAL_ROUTER_LIGHT_THRESHOLD = float(os.getenv("EVAL_ROUTER_LIGHT_THRESHOLD", "0.3"))
+
+# Evaluations are keyed on the whitespace-normalized request fields so that
+# client retries of the same step are served without another LLM call. Every
+# setting that can change an evaluation is folded in too: models, system
+# prompt, message templates, output schemas and cap, reasoning settings,
+# history window, light-model routing, the canned exact-match reply and the
+# fused transcription inputs. Changing any of them invalidates earlier
+# evaluations, so entries can live for weeks.
+EVAL_CACHE_VERSION = content_key(
+    json.dumps([
+        GPT_NANO_MODEL, GPT_LIGHT_MODEL, eval_prompt, EVAL_PROBLEM_TEMPLATE, EVAL_STEP_TEMPLATE,
+        EVALUATION_RESPONSE_FORMAT, EVAL_MAX_OUTPUT_TOKENS, EVAL_VERBOSITY, EVAL_REASONING_EFFORT,
+        HISTORY_MAX_TOKENS, EXACT_MATCH_EVALUATION, EVAL_ROUTER_LIGHT_MODEL, EVAL_ROUTER_LIGHT_THRESHOLD,
+        EMBEDDING_MODEL, EVALUATION_WITH_TRANSCRIPTION_FORMAT, FUSED_STUDENT_WORK, ocr_prompt, OCR_MAX_EDGE_PX, OCR_JPEG_QUALITY
+    ]).encode('utf-8')
+)[:12]
+EVAL_CACHE_MAX_ENTRIES = 4096
+EVAL_CACHE_TTL_SECONDS = int(os.getenv("EVAL_CACHE_TTL_SECONDS", str(14 * 24 * 3600)))
+eval_cache = create_result_cache(
+    maxsize=EVAL_CACHE_MAX_ENTRIES,
+    ttl=EVAL_CACHE_TTL_SECONDS,
+    directory=_cache_directory("eval"),
+    size_limit=CACHE_SIZE_LIMIT_BYTES
+)
 
 def _mask_key(key: str) -> str:
     """Return a lightly masked version of an API key for debugging."""
@@ -34,6 +289,116 @@ def _mask_key(key: str) -> str:
         return f"{key[:2]}***"
     return f"{key[:4]}...{key[-4:]}"
 
+def _normalize_text(value: Any) -> Any:
+    """Collapse runs of whitespace so trivially different retries share a cache key."""
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    return value
+
+def _evaluation_key(
+    question: str,
+    correct_answer: str,
+    student_work: str,
+    step_count: int,
+    prev_history: str
+) -> str:
+    """Build the cache key for an evaluation request."""
+    payload = json.dumps({
+        "v": EVAL_CACHE_VERSION,
+        "q": _normalize_text(question),
+        "a": _normalize_text(correct_answer),
+        "s": _normalize_text(student_work),
+        "n": step_count,
+        "h": _normalize_text(prev_history)
+    }, sort_keys=True)
+    return content_key(payload.encode('utf-8'))
+
+def _prompt_cache_key(question: str, correct_answer: str) -> str:
+    """Key the session-invariant prompt segment so every step of a problem shares a prompt cache."""
+    segment = f"{GPT_NANO_MODEL}\n{_normalize_text(question)}\n{_normalize_text(correct_answer)}"
+    return content_key(segment.encode('utf-8'))
+
+def _log_prompt_cache_usage(response) -> None:
+    """Log how many input tokens were served from OpenAI's prompt cache."""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    details = getattr(usage, 'input_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+    reasoning_tokens = getattr(getattr(usage, 'output_tokens_details', None), 'reasoning_tokens', 0) or 0
+    logger.info(
+        "Evaluation tokens: input=%d cached=%d (%.0f%%) output=%d reasoning=%d",
+        usage.input_tokens,
+        cached_tokens,
+        100.0 * cached_tokens / usage.input_tokens if usage.input_tokens else 0.0,
+        usage.output_tokens,
+        reasoning_tokens
+    )
+
+def _recent_history(prev_history: str) -> str:
+    """Keep the most recent whole steps of a session's history within HISTORY_MAX_TOKENS."""
+    max_chars = HISTORY_MAX_TOKENS * 4
+    if not isinstance(prev_history, str) or len(prev_history) <= max_chars:
+        return prev_history
+    recent = prev_history[-max_chars:]
+    line_start = recent.find('\n')
+    if line_start != -1:
+        recent = recent[line_start + 1:]
+    return "(earlier steps omitted)\n" + recent
+
+def _estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """Estimate the tokens a Responses API request will consume, output included."""
+    parts = [
+        part
+        for message in request['input'] if message['role'] != 'system'
+        for part in message['content']
+    ]
+    text = ''.join(part.get('text', '') for part in parts)
+    images = sum(1 for part in parts if part['type'] == 'input_image')
+    return EVAL_PROMPT_TOKENS + estimate_tokens(text) + images * IMAGE_INPUT_TOKEN_ESTIMATE + EVAL_MAX_OUTPUT_TOKENS
+
+def _record_ocr_tier(tier: str) -> None:
+    """Count which OCR tier served a request and log the running escalation rate."""
+    with _ocr_tier_lock:
+        _ocr_tier_counts[tier] += 1
+        escalated = _ocr_tier_counts["escalated"]
+        total = sum(_ocr_tier_counts.values())
+    logger.info("OCR served by %s tier (escalation rate %.1f%% of %d)", tier, 100.0 * escalated / total, total)
+
+def _cheap_ocr_is_confident(text: str) -> bool:
+    """Decide whether the cheap OCR tier's text can be served without escalating."""
+    text = text.strip()
+    if len(text) < OCR_CHEAP_MIN_CHARS or OCR_UNCERTAIN_MARKER in text or '\ufffd' in text:
+        return False
+    non_ascii = sum(1 for char in text if not char.isascii())
+    return non_ascii <= OCR_CHEAP_MAX_NON_ASCII_RATIO * len(text)
+
+def _encode_for_ocr(img: Image.Image, image_bytes: bytes) -> types.Part:
+    """
+    Prepare an image for Gemini.
+
+    Images already within OCR_MAX_EDGE_PX in a format Gemini reads are sent as
+    the original bytes; Image.open only parsed their header, so their pixels
+    are never decoded. Anything else is shrunk in place on its long edge and
+    re-encoded as JPEG.
+    """
+    if max(img.size) <= OCR_MAX_EDGE_PX and img.format in OCR_PASSTHROUGH_FORMATS:
+        return types.Part.from_bytes(data=image_bytes, mime_type=Image.MIME[img.format])
+    img.thumbnail((OCR_MAX_EDGE_PX, OCR_MAX_EDGE_PX), Image.LANCZOS)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=OCR_JPEG_QUALITY)
+    return types.Part.from_bytes(data=buffer.getvalue(), mime_type='image/jpeg')
+
+def _read_image_bytes(image_data) -> bytes:
+    """Read raw image bytes from a file path or a file-like object."""
+    if hasattr(image_data, 'read'):
+        image_data.seek(0)
+        return image_data.read()
+    with open(image_data, 'rb') as image_file:
+        return image_file.read()
+
 def _api_key_hint() -> str:
     """Expose partial API keys to help debug which credentials are in use."""
     return (
@@ -41,6 +406,20 @@ def _api_key_hint() -> str:
         f"google={_mask_key(os.getenv('GOOGLE_API_KEY', ''))}"
     )
 
+def _seconds_left(deadline: Optional[float]) -> Optional[float]:
+    """
+    Return the seconds left before a time.perf_counter() deadline, or None without one.
+
+    Raises:
+        TimeoutError: If the deadline has already passed.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        raise TimeoutError("Full evaluation deadline exceeded")
+    return remaining
+
 class MathEvaluationService:
     """Service class for handling math evaluation operations"""
 
@@ -50,40 +429,122 @@ class MathEvaluationService:
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
         logger.info("OpenAI API key found.")
-        self.client = OpenAI(api_key=api_key)
+        self.client = OpenAI(
+            api_key=api_key,
+            timeout=OPENAI_TIMEOUT,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=openai_http_client
+        )
         self.system_prompt = self._get_system_prompt()
+        # The system message never changes, so every request shares this one (read-only) dict
+        self._system_message = {
+            "role": "system",
+            "content": [{"type": "input_text", "text": self.system_prompt}]
+        }
+        self._genai_client = None
+        self._genai_client_lock = threading.Lock()
+        self.router = EvaluationRouter(
+            embed=self._embed_texts if EVAL_ROUTER_LIGHT_MODEL else None,
+            light_threshold=EVAL_ROUTER_LIGHT_THRESHOLD
+        )
+
+    def _gemini_client(self) -> genai.Client:
+        """
+        Return the shared Gemini client, creating it on first use.
+
+        One client keeps one connection pool, so OCR calls reuse warm connections.
+        It is created lazily so a missing Google key only fails OCR, not startup.
+        """
+        if self._genai_client is None:
+            with self._genai_client_lock:
+                if self._genai_client is None:
+                    self._genai_client = genai.Client(
+                        http_options=types.HttpOptions(timeout=int(GEMINI_TIMEOUT_SECONDS * 1000))
+                    )
+        return self._genai_client
 
     def _get_system_prompt(self) -> str:
         """Get the system prompt for evaluation"""
         return eval_prompt
 
-    def extract_text_from_image(self, image_data: str) -> Dict[str, Any]:
+    def extract_text_from_image(self, image_data: str, deadline: Optional[float] = None) -> Dict[str, Any]:
         """
         Extract handwritten text from image using Google's Gemini API.
 
+        Results are cached by image content, so resubmitting identical
+        bytes skips the Gemini call. When enabled, local Tesseract and then
+        OCR_CHEAP_MODEL are tried first, escalating to GEMINI_FLASH_MODEL
+        only when their text is not confident.
+
         Args:
-            image_data: Path to the image file.
+            image_data: Path to the image file or a file-like object.
+            deadline: time.perf_counter() value by which Gemini calls must finish, if any.
 
         Returns:
             A dictionary with success status, extracted text, and error info.
         """
         try:
-            client1 = genai.Client()
-            img = Image.open(image_data)
+            image_bytes = _read_image_bytes(image_data)
+            image_key = content_key(image_bytes)
+            cache_key = f"{OCR_CACHE_VERSION}:{image_key}"
+            cached = ocr_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("OCR cache hit for image %s", image_key[:12])
+                return cached
 
-            response = client1.models.generate_content(
-                model=GEMINI_FLASH_MODEL,
-                contents=[img, ocr_prompt]
-            )
-            extracted_text = response.text
+            img = Image.open(io.BytesIO(image_bytes))
 
-            logger.info("Successfully extracted text: %s...", extracted_text[:100])
+            perceptual_hash = None
+            if OCR_PERCEPTUAL_CACHE:
+                perceptual_hash = int(str(imagehash.phash(img, hash_size=8)), 16)
+                similar_key = ocr_perceptual_index.find(perceptual_hash, OCR_PERCEPTUAL_MAX_DISTANCE)
+                cached = ocr_cache.get(similar_key) if similar_key else None
+                if cached is not None:
+                    logger.debug("OCR perceptual cache hit for image %s", image_key[:12])
+                    ocr_cache.set(cache_key, cached)
+                    return cached
 
-            return {
+            if LOCAL_OCR_FIRST:
+                local_text = self.extract_text_fast(img)
+                if local_text:
+                    _record_ocr_tier("local")
+                    result = {
+                        "success": True,
+                        "text": local_text,
+                        "error": None
+                    }
+                    ocr_cache.set(cache_key, result)
+                    return result
+
+            # Encode before taking a Gemini slot so the slot only covers network time
+            ocr_image = _encode_for_ocr(img, image_bytes)
+            extracted_text = None
+            if OCR_CHEAP_MODEL:
+                try:
+                    cheap_text = self._gemini_ocr(OCR_CHEAP_MODEL, ocr_image, OCR_CHEAP_PROMPT, deadline)
+                except Exception as e:
+                    logger.warning("Cheap OCR tier failed, escalating to %s: %s", GEMINI_FLASH_MODEL, e)
+                    cheap_text = ''
+                if _cheap_ocr_is_confident(cheap_text):
+                    _record_ocr_tier("cheap")
+                    extracted_text = cheap_text
+
+            if extracted_text is None:
+                if LOCAL_OCR_FIRST or OCR_CHEAP_MODEL:
+                    _record_ocr_tier("escalated")
+                extracted_text = self._gemini_ocr(GEMINI_FLASH_MODEL, ocr_image, ocr_prompt, deadline)
+
+            logger.debug("Successfully extracted text: %s...", extracted_text[:100])
+
+            result = {
                 "success": True,
                 "text": extracted_text,
                 "error": None
             }
+            ocr_cache.set(cache_key, result)
+            if perceptual_hash is not None:
+                ocr_perceptual_index.add(perceptual_hash, cache_key)
+            return result
 
         except FileNotFoundError:
             logger.error("OCR Error: Image file not found at path: %s", image_data)
@@ -104,13 +565,65 @@ class MathEvaluationService:
                 "key_hint": key_hint
             }
 
+    def _gemini_ocr(self, model: str, ocr_image: types.Part, prompt: str, deadline: Optional[float] = None) -> str:
+        """Transcribe a prepared image with a Gemini model, streaming the reply."""
+        config = types.GenerateContentConfig(max_output_tokens=OCR_MAX_OUTPUT_TOKENS)
+        remaining = _seconds_left(deadline)
+        if remaining is not None and remaining < GEMINI_TIMEOUT_SECONDS:
+            config.http_options = types.HttpOptions(timeout=int(remaining * 1000))
+        parts = []
+        with gemini_slots:
+            started = time.perf_counter()
+            for chunk in self._gemini_client().models.generate_content_stream(
+                model=model,
+                contents=[ocr_image, prompt],
+                config=config
+            ):
+                if not parts:
+                    logger.debug("OCR first chunk from %s after %.2f seconds", model, time.perf_counter() - started)
+                if chunk.text:
+                    parts.append(chunk.text)
+        return ''.join(parts)
+
+    def extract_text_fast(self, img: Image.Image) -> Optional[str]:
+        """
+        Extract text locally with Tesseract, without any API call.
+
+        Args:
+            img: The opened image.
+
+        Returns:
+            The recognized text, or None when Tesseract is unavailable, finds
+            nothing, or is below LOCAL_OCR_MIN_CONFIDENCE on any word.
+        """
+        try:
+            data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+        except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+            logger.warning("Local OCR unavailable, escalating to Gemini: %s", e)
+            return None
+
+        lines = {}
+        confidences = []
+        for i, word in enumerate(data['text']):
+            confidence = float(data['conf'][i])
+            if confidence < 0 or not word.strip():
+                continue
+            confidences.append(confidence)
+            line_id = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(line_id, []).append(word)
+
+        if not confidences or min(confidences) < LOCAL_OCR_MIN_CONFIDENCE:
+            return None
+        return '\n'.join(' '.join(words) for words in lines.values())
+
     def evaluate_math_solution(
         self,
         question: str,
         correct_answer: str,
         student_work: str,
         step_count: int,
-        prev_history: str
+        prev_history: str,
+        deadline: Optional[float] = None
     ) -> Dict[str, Any]:
         """
         Evaluate student's math solution against correct answer.
@@ -120,48 +633,55 @@ class MathEvaluationService:
             correct_answer: The expected correct answer.
             student_work: Student's work/answer.
             step_count: Current step count for tracking.
+            deadline: time.perf_counter() value by which the OpenAI call must finish, if any.
 
         Returns:
             A dictionary containing evaluation results.
         """
-        try:
-            user_content = (
-                f"Question: {question}\n"
-                f"Correct Answer: {correct_answer}\n"
-                f"Students previous steps (Ignore if this answers is wrong): {prev_history}\n, Dont judge this step. Check this only when necessary"
-                f"Student's Current Answer: {student_work}\n, Evaluate this step only."
-            )
+        cache_key = _evaluation_key(question, correct_answer, student_work, step_count, prev_history)
+        cached = eval_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Evaluation cache hit for key %s", cache_key[:12])
+            return cached
 
-            response = self.client.responses.create(
-                model=GPT_NANO_MODEL,
-                input=[
-                    {
-                        "role": "system",
-                        "content": [{"type": "input_text", "text": self.system_prompt}]
-                    },
-                    {
-                        "role": "user",
-                        "content": [{"type": "input_text", "text": user_content}]
-                    }
-                ],
-                text={ "verbosity": "low" },
-                reasoning={ "effort": "low" },
-            )
+        route = self.router.route(student_work, correct_answer)
+        if route == ROUTE_EXACT:
+            ret = self._exact_match_result(step_count)
+            eval_cache.set(cache_key, ret)
+            return ret
+        model = GPT_LIGHT_MODEL if route == ROUTE_LIGHT else GPT_NANO_MODEL
 
-            evaluation_text = response.output_text
-            # Clean up any markdown formatting
-            evaluation_text = evaluation_text.replace('```json', '').replace('```', '').strip()
+        problem_key = _prompt_cache_key(question, correct_answer)
+        embedding = None
+        if SEMANTIC_CACHE:
+            embedding = self._embed_student_work(student_work, prev_history)
+            hit = semantic_cache.get(problem_key, embedding) if embedding else None
+            if hit is not None:
+                hit_id, similarity, result = hit
+                logger.debug("Semantic evaluation cache hit %s (similarity %.4f)", hit_id, similarity)
+                result["nextStepCount"] = step_count + 1
+                result["semantic_cache"] = {"id": hit_id, "similarity": round(similarity, 4)}
+                return result
 
-            logger.info("Successfully evaluated solution for question: %s...", evaluation_text[:100])
+        try:
+            with openai_slots:
+                response = self._create_response(
+                    self.build_evaluation_request(question, correct_answer, student_work, prev_history, model=model),
+                    deadline=deadline
+                )
+            _log_prompt_cache_usage(response)
 
             # Use a different name than the built-in 'eval'
-            evaluation_data = json.loads(evaluation_text)
+            evaluation_data = self.parse_evaluation_text(response.output_text)
             ret = {
                 "success": True,
                 "nextStepCount": step_count + 1,
                 "error": None
             }
             ret.update(evaluation_data)
+            eval_cache.set(cache_key, ret)
+            if embedding:
+                semantic_cache.put(problem_key, embedding, ret)
             return ret
 
         except json.JSONDecodeError as e:
@@ -187,34 +707,375 @@ class MathEvaluationService:
                 "key_hint": key_hint
             }
 
+    def stream_math_solution(
+        self,
+        question: str,
+        correct_answer: str,
+        student_work: str,
+        step_count: int,
+        prev_history: str
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Evaluate student's math solution, yielding output text as it is generated.
+
+        Args:
+            question: The original math problem.
+            correct_answer: The expected correct answer.
+            student_work: Student's work/answer.
+            step_count: Current step count for tracking.
+            prev_history: The student's previous steps.
+
+        Yields:
+            ("delta", text) for each output fragment, then a single ("result", dict)
+            shaped like the return value of evaluate_math_solution.
+        """
+        cache_key = _evaluation_key(question, correct_answer, student_work, step_count, prev_history)
+        cached = eval_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Evaluation cache hit for key %s", cache_key[:12])
+            yield "result", cached
+            return
+
+        route = self.router.route(student_work, correct_answer)
+        if route == ROUTE_EXACT:
+            ret = self._exact_match_result(step_count)
+            eval_cache.set(cache_key, ret)
+            yield "result", ret
+            return
+        model = GPT_LIGHT_MODEL if route == ROUTE_LIGHT else GPT_NANO_MODEL
+
+        try:
+            fragments = []
+            # The slot is held until the stream ends or the client disconnects
+            with openai_slots:
+                stream = self._create_response(
+                    self.build_evaluation_request(question, correct_answer, student_work, prev_history, model=model),
+                    stream=True
+                )
+                for event in stream:
+                    if event.type == "response.output_text.delta":
+                        fragments.append(event.delta)
+                        yield "delta", event.delta
+                    elif event.type == "response.completed":
+                        _log_prompt_cache_usage(event.response)
+
+            evaluation_data = self.parse_evaluation_text(''.join(fragments))
+            ret = {
+                "success": True,
+                "nextStepCount": step_count + 1,
+                "error": None
+            }
+            ret.update(evaluation_data)
+            eval_cache.set(cache_key, ret)
+            yield "result", ret
+
+        except json.JSONDecodeError as e:
+            logger.error("Evaluation failed: Could not decode JSON from API response. Error: %s", e)
+            key_hint = _api_key_hint()
+            yield "result", {
+                "success": False,
+                "evaluation": None,
+                "hint": None,
+                "nextStepCount": step_count + 1,
+                "error": f"Invalid JSON response from evaluation API: {e} (keys: {key_hint})",
+                "key_hint": key_hint
+            }
+        except Exception as e:
+            logger.error("An unexpected error occurred during streamed evaluation: %s", e, exc_info=True)
+            key_hint = _api_key_hint()
+            yield "result", {
+                "success": False,
+                "evaluation": None,
+                "hint": None,
+                "nextStepCount": step_count + 1,
+                "error": f"An unexpected evaluation error occurred: {str(e)} (keys: {key_hint})",
+                "key_hint": key_hint
+            }
+
+    def _create_response(self, request: Dict[str, Any], stream: bool = False, deadline: Optional[float] = None):
+        """
+        Call responses.create once the rate limiter admits the request, then sync its limits.
+
+        With a deadline, the call gets only the time left: a shorter timeout when
+        needed, and no retry unless a retry's worst case still fits.
+        """
+        openai_rate_limiter.acquire(_estimate_request_tokens(request))
+        client = self.client
+        remaining = _seconds_left(deadline)
+        if remaining is not None and remaining < OPENAI_CALL_MAX_SECONDS:
+            client = client.with_options(
+                timeout=httpx.Timeout(
+                    min(remaining, OPENAI_TIMEOUT_SECONDS),
+                    connect=min(remaining, OPENAI_CONNECT_TIMEOUT_SECONDS)
+                ),
+                max_retries=0
+            )
+        raw_response = client.responses.with_raw_response.create(**request, stream=stream)
+        openai_rate_limiter.update_from_headers(raw_response.headers)
+        return raw_response.parse()
+
+    def submit_batch_evaluation(self, items: List[Dict[str, Any]]):
+        """
+        Submit evaluations to the OpenAI Batch API as one JSONL upload.
+
+        Args:
+            items: Evaluation requests with question, correct_answer, student_answer,
+                optional chat_history and an optional caller-chosen id.
+
+        Returns:
+            The created Batch object.
+        """
+        lines = []
+        for index, item in enumerate(items):
+            body = self.build_evaluation_request(
+                item['question'],
+                item['correct_answer'],
+                item['student_answer'],
+                item.get('chat_history', '')
+            )
+            lines.append(json.dumps({
+                "custom_id": str(item.get('id', index)),
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": body
+            }))
+
+        input_file = self.client.files.create(
+            file=("evaluations.jsonl", io.BytesIO('\n'.join(lines).encode('utf-8'))),
+            purpose="batch"
+        )
+        return self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
+
+    def build_evaluation_request(
+        self,
+        question: str,
+        correct_answer: str,
+        student_work: str,
+        prev_history: str,
+        model: str = GPT_NANO_MODEL
+    ) -> Dict[str, Any]:
+        """
+        Build the Responses API request body for one evaluation.
+
+        Shared by the synchronous path and the Batch API so both send identical requests.
+
+        Args:
+            question: The original math problem.
+            correct_answer: The expected correct answer.
+            student_work: Student's work/answer.
+            prev_history: The student's previous steps.
+            model: The model to evaluate with.
+
+        Returns:
+            Keyword arguments for responses.create, also valid as a batch request body.
+        """
+        # The system prompt is the invariant cacheable prefix. The problem message
+        # is identical for every step of a problem, so it extends that prefix;
+        # only the step message varies between a session's calls.
+        problem_content = EVAL_PROBLEM_TEMPLATE.format(question=question, correct_answer=correct_answer)
+        step_content = EVAL_STEP_TEMPLATE.format(history=_recent_history(prev_history), student_work=student_work)
+
+        return {
+            "model": model,
+            "input": [
+                self._system_message,
+                {
+                    "role": "user",
+                    "content": [{"type": "input_text", "text": problem_content}]
+                },
+                {
+                    "role": "user",
+                    "content": [{"type": "input_text", "text": step_content}]
+                }
+            ],
+            "text": { "format": EVALUATION_RESPONSE_FORMAT, "verbosity": EVAL_VERBOSITY },
+            "reasoning": { "effort": EVAL_REASONING_EFFORT },
+            "max_output_tokens": EVAL_MAX_OUTPUT_TOKENS,
+            "prompt_cache_key": _prompt_cache_key(question, correct_answer),
+        }
+
+    def parse_evaluation_text(self, evaluation_text: str) -> Dict[str, Any]:
+        """
+        Parse the model's JSON evaluation.
+
+        The strict response schema constrains decoding to the bare JSON object, so
+        there are no code fences to strip; invalid JSON only comes from a reply cut
+        off at max_output_tokens or a refusal.
+
+        Raises:
+            json.JSONDecodeError: If the text is not valid JSON (orjson's error subclasses it).
+        """
+        logger.debug("Successfully evaluated solution for question: %s...", evaluation_text[:100])
+
+        return orjson.loads(evaluation_text)
+
+    @staticmethod
+    def _exact_match_result(step_count: int) -> Dict[str, Any]:
+        """Build the evaluation for an answer identical to the expected answer."""
+        ret = {
+            "success": True,
+            "nextStepCount": step_count + 1,
+            "error": None
+        }
+        ret.update(EXACT_MATCH_EVALUATION)
+        return ret
+
+    def _embed_texts(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Embed several texts in one call, or None if the call fails."""
+        try:
+            response = self.client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+            return [item.embedding for item in response.data]
+        except Exception as e:
+            logger.warning("Embedding failed, routing to the full model: %s", e)
+            return None
+
+    def _embed_student_work(self, student_work: str, prev_history: str) -> Optional[list]:
+        """Embed the variable part of an evaluation request, or None if the call fails."""
+        try:
+            response = self.client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=f"{_normalize_text(prev_history)}\n{_normalize_text(student_work)}"
+            )
+            return response.data[0].embedding
+        except Exception as e:
+            logger.warning("Embedding failed, skipping semantic cache: %s", e)
+            return None
+
+    def record_semantic_feedback(self, hit_id: str, helpful: bool) -> Dict[str, Any]:
+        """
+        Record whether a semantic cache hit produced a good evaluation.
+
+        Args:
+            hit_id: The id returned in the hit's "semantic_cache" field.
+            helpful: Whether the reused evaluation was appropriate.
+
+        Returns:
+            A dictionary with success status, the current threshold, and error info.
+        """
+        if not semantic_cache.record_feedback(hit_id, helpful):
+            return {"success": False, "threshold": semantic_cache.threshold, "error": "Unknown or expired cache hit id"}
+        logger.info("Semantic cache feedback (helpful=%s); threshold now %.3f", helpful, semantic_cache.threshold)
+        return {"success": True, "threshold": semantic_cache.threshold, "error": None}
+
+    def evaluate_math_solution_multimodal(
+        self,
+        image_data,
+        question: str,
+        correct_answer: str,
+        step_count: int,
+        prev_history: str,
+        deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Transcribe and evaluate handwritten work in a single model call.
+
+        Args:
+            image_data: Path to the image file or a file-like object.
+            question: The original math problem.
+            correct_answer: The expected correct answer.
+            step_count: Current step count for tracking.
+            prev_history: The student's previous steps.
+            deadline: time.perf_counter() value by which the OpenAI call must finish, if any.
+
+        Returns:
+            A dictionary shaped like evaluate_math_solution's result, plus extracted_text.
+        """
+        try:
+            image_bytes = _read_image_bytes(image_data)
+            cache_key = _evaluation_key(
+                question, correct_answer, f"image:{content_key(image_bytes)}", step_count, prev_history
+            )
+            cached = eval_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Fused evaluation cache hit for key %s", cache_key[:12])
+                return cached
+
+            image = _encode_for_ocr(Image.open(io.BytesIO(image_bytes)), image_bytes).inline_data
+            request = self.build_evaluation_request(question, correct_answer, FUSED_STUDENT_WORK, prev_history)
+            request["input"][-1]["content"].extend([
+                {"type": "input_text", "text": f"\nTranscription rules for extracted_text:\n{ocr_prompt}"},
+                {
+                    "type": "input_image",
+                    "image_url": f"data:{image.mime_type};base64,{base64.b64encode(image.data).decode('ascii')}"
+                }
+            ])
+            request["text"]["format"] = EVALUATION_WITH_TRANSCRIPTION_FORMAT
+
+            with openai_slots:
+                response = self._create_response(request, deadline=deadline)
+            _log_prompt_cache_usage(response)
+
+            ret = {
+                "success": True,
+                "nextStepCount": step_count + 1,
+                "error": None
+            }
+            ret.update(self.parse_evaluation_text(response.output_text))
+            eval_cache.set(cache_key, ret)
+            return ret
+
+        except Exception as e:
+            logger.warning("Fused OCR + evaluation failed: %s", e, exc_info=True)
+            return {
+                "success": False,
+                "evaluation": None,
+                "hint": None,
+                "nextStepCount": step_count + 1,
+                "error": f"Fused evaluation failed: {e}"
+            }
+
     def process_full_evaluation(
         self,
         image_data: str,
         question: str,
         correct_answer: str,
         step_count: int,
-        prev_history: str
+        prev_history: str,
+        deadline: Optional[float] = None
     ) -> Dict[str, Any]:
         """
         Perform OCR + Evaluation in one operation.
 
         Args:
-            image_data: Path to the image file.
+            image_data: Path to the image file or a file-like object.
             question: Math question.
             correct_answer: Expected answer.
             step_count: Current step count.
+            deadline: time.perf_counter() value by which every call must finish;
+                defaults to FULL_EVALUATION_DEADLINE_SECONDS from now.
 
         Returns:
             Combined OCR and evaluation results.
         """
-        # Step 1: Extract text
-        start_time = time.time()
-        ocr_result = self.extract_text_from_image(image_data)
-        ocr_duration = time.time() - start_time
-        logger.info("OCR processing time: %.2f seconds", ocr_duration)
+        # With fused mode, one call both transcribes and evaluates. Its time is
+        # reported on its own, since a failed fused call falls back to both steps.
+        if deadline is None:
+            deadline = time.perf_counter() + FULL_EVALUATION_DEADLINE_SECONDS
+        eval_result = None
+        fused_duration = 0.0
+        ocr_result = None
+        if FUSED_OCR_EVALUATION:
+            start_time = time.perf_counter()
+            fused_result = self.evaluate_math_solution_multimodal(
+                image_data, question, correct_answer, step_count, prev_history, deadline=deadline
+            )
+            fused_duration = time.perf_counter() - start_time
+            if fused_result['success']:
+                ocr_result = {"success": True, "text": fused_result.pop('extracted_text'), "error": None}
+                eval_result = fused_result
+
+        # Step 1: Extract text, unless the fused call already did
+        start_time = time.perf_counter()
+        if ocr_result is None:
+            ocr_result = self.extract_text_from_image(image_data, deadline=deadline)
+        ocr_duration = time.perf_counter() - start_time
 
         if not ocr_result['success']:
-            logger.info("OCR Failed")
+            logger.info("Full evaluation OCR failed: fused=%.3fs ocr=%.3fs", fused_duration, ocr_duration)
             key_hint = ocr_result.get('key_hint', _api_key_hint())
             return {
                 "success": False,
@@ -225,22 +1086,21 @@ class MathEvaluationService:
             }
 
         # Step 2: Evaluate the extracted text
-        start_time = time.time()
-        eval_result = self.evaluate_math_solution(
-            question,
-            correct_answer,
-            ocr_result['text'],
-            step_count, 
-            prev_history
+        start_time = time.perf_counter()
+        if eval_result is None:
+            eval_result = self.evaluate_math_solution(
+                question,
+                correct_answer,
+                ocr_result['text'],
+                step_count,
+                prev_history,
+                deadline=deadline
+            )
+        eval_duration = time.perf_counter() - start_time
+        logger.info(
+            "Full evaluation timings: fused=%.3fs ocr=%.3fs eval=%.3fs", fused_duration, ocr_duration, eval_duration
         )
-        eval_duration = time.time() - start_time
-        # print("---------------------------------\n", prev_history)
         cur_history = prev_history + "\n" + ocr_result['text']
-        # print("---------------------------------\n", cur_history)
-        # For debugging purposes, you might want to log the full extracted text and evaluation result
-        # logger.info("Successfully extracted text: %s...", eval_result)
-        print(eval_result)
-        logger.info("Evaluation processing time: %.2f seconds", eval_duration)
 
         if not eval_result['success']:
             key_hint = eval_result.get('key_hint', _api_key_hint())
@@ -255,16 +1115,11 @@ class MathEvaluationService:
                 "key_hint": key_hint
             }
 
-        # Determine if the process is finished based on the hint content
-        is_finished = 'correct' in eval_result.get('verdict', '').lower()
-        if 'incorrect' in eval_result.get('verdict', '').lower():
-            is_finished = False
-        elif 'on track' in eval_result.get('verdict', '').lower():
-            is_finished = False
-        elif 'correct' in eval_result.get('verdict', '').lower():
-            is_finished = True
+        # The work is finished only on an exact "correct" verdict; note that
+        # "incorrect" contains "correct", so substring checks don't work here.
+        verdict = (eval_result.get('verdict') or '').strip().lower()
+        is_finished = verdict == 'correct'
 
-        
         return {
             "success": True,
             "extracted_text": ocr_result['text'],
@@ -274,7 +1129,7 @@ class MathEvaluationService:
             "error": None,
             "is_finished": is_finished,
             "chat_history": cur_history,
-            "verdict": eval_result.get('verdict').lower()
+            "verdict": verdict
         }
 
 
@@ -289,6 +1144,22 @@ class ValidationService:
         'image/gif',
         'image/webp'
     }
+    SUPPORTED_IMAGE_TYPES_STR = ', '.join(sorted(SUPPORTED_IMAGE_TYPES))
+
+    # Leading bytes of each supported image format (WebP also carries "WEBP" at offset 8)
+    IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'RIFF')
+    IMAGE_SIGNATURE_LENGTH = 12
+
+    # Fields that must be present and non-empty, in the order they are reported
+    REQUIRED_EVALUATION_FIELDS = ('question', 'correct_answer', 'student_answer')
+    REQUIRED_FULL_EVALUATION_FIELDS = ('image', 'question', 'correct_answer')
+    REQUIRED_FULL_EVALUATION_BATCH_FIELDS = ('question', 'correct_answer')
+
+    # Upper bound on evaluations accepted in a single batch request. Image
+    # batches share one full evaluation deadline, so they are kept smaller.
+    MAX_BATCH_ITEMS = 50
+    MAX_BULK_ITEMS = 5000
+    MAX_FULL_EVALUATION_BATCH_ITEMS = 20
 
     @staticmethod
     def validate_image_data(image_data: str) -> Dict[str, Any]:
@@ -300,13 +1171,37 @@ class ValidationService:
         if image_data.startswith('data:image'):
             image_data = image_data.split(',', 1)[1]
 
-        # Basic base64 validation
+        # Basic base64 validation; pybase64's SIMD decoder checks even a large
+        # payload faster than a regex could scan it, and the decoded bytes are
+        # returned so callers need not decode the image a second time
         try:
-            base64.b64decode(image_data, validate=True)
-            return {"valid": True, "cleaned_data": image_data, "error": None}
+            decoded = base64.b64decode(image_data, validate=True)
+            return {"valid": True, "cleaned_data": image_data, "decoded": decoded, "error": None}
         except (ValueError, TypeError):
             return {"valid": False, "error": "Invalid base64 image data format"}
 
+    @staticmethod
+    def estimate_decoded_size(image_data: str) -> int:
+        """Compute the decoded size of base64 image data without decoding it"""
+        start = image_data.find(',') + 1 if image_data.startswith('data:image') else 0
+        length = len(image_data) - start
+        padding = 2 if image_data.endswith('==') else 1 if image_data.endswith('=') else 0
+        return max((length * 3 >> 2) - padding, 0)
+
+    @staticmethod
+    def validate_image_signature(header: bytes) -> Dict[str, Any]:
+        """Check the leading bytes of an upload against the supported image formats"""
+        header = bytes(header[:ValidationService.IMAGE_SIGNATURE_LENGTH])
+        if header.startswith(ValidationService.IMAGE_SIGNATURES) and (
+            not header.startswith(b'RIFF') or header[8:12] == b'WEBP'
+        ):
+            return {"valid": True, "error": None}
+
+        return {
+            "valid": False,
+            "error": f"Unrecognized image format. Supported types: {ValidationService.SUPPORTED_IMAGE_TYPES_STR}"
+        }
+
     @staticmethod
     def validate_mime_type(mime_type: str) -> Dict[str, Any]:
         """Validate image MIME type"""
@@ -314,10 +1209,9 @@ class ValidationService:
             return {"valid": False, "error": "MIME type is required"}
 
         if mime_type not in ValidationService.SUPPORTED_IMAGE_TYPES:
-            supported_types_str = ', '.join(ValidationService.SUPPORTED_IMAGE_TYPES)
             return {
                 "valid": False,
-                "error": f"Unsupported MIME type: {mime_type}. Supported types: {supported_types_str}"
+                "error": f"Unsupported MIME type: {mime_type}. Supported types: {ValidationService.SUPPORTED_IMAGE_TYPES_STR}"
             }
 
         return {"valid": True, "error": None}
@@ -325,8 +1219,7 @@ class ValidationService:
     @staticmethod
     def validate_evaluation_request(data: Dict[str, Any]) -> Dict[str, Any]:
         """Validate evaluation request data"""
-        required_fields = ['question', 'correct_answer', 'student_answer']
-        missing_fields = [field for field in required_fields if not data.get(field)]
+        missing_fields = [field for field in ValidationService.REQUIRED_EVALUATION_FIELDS if not data.get(field)]
 
         if missing_fields:
             return {
@@ -339,8 +1232,7 @@ class ValidationService:
     @staticmethod
     def validate_full_evaluation_request(data: Dict[str, Any]) -> Dict[str, Any]:
         """Validate full evaluation request data"""
-        required_fields = ['image', 'question', 'correct_answer']
-        missing_fields = [field for field in required_fields if not data.get(field)]
+        missing_fields = [field for field in ValidationService.REQUIRED_FULL_EVALUATION_FIELDS if not data.get(field)]
 
         if missing_fields:
             return {
@@ -355,7 +1247,87 @@ class ValidationService:
 
         return {"valid": True, "error": None}
 
+    @staticmethod
+    def validate_feedback_request(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate semantic cache feedback data"""
+        if not isinstance(data.get('id'), str) or not data['id']:
+            return {"valid": False, "error": "Field 'id' must be a non-empty string"}
+        if not isinstance(data.get('helpful'), bool):
+            return {"valid": False, "error": "Field 'helpful' must be a boolean"}
+        return {"valid": True, "error": None}
+
+    @staticmethod
+    def validate_batch_evaluation_request(data: Dict[str, Any], max_items: int = MAX_BATCH_ITEMS) -> Dict[str, Any]:
+        """Validate batch evaluation request data"""
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return {"valid": False, "error": "Field 'items' must be a non-empty list"}
+
+        if len(items) > max_items:
+            return {
+                "valid": False,
+                "error": f"Too many items: {len(items)}. Maximum is {max_items}"
+            }
+
+        # Item ids become Batch API custom_ids, defaulting to the item's index, and
+        # a single duplicate makes OpenAI reject the whole upload
+        item_ids = set()
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                return {"valid": False, "error": f"Item {index}: must be an object"}
+            item_validation = ValidationService.validate_evaluation_request(item)
+            if not item_validation['valid']:
+                return {"valid": False, "error": f"Item {index}: {item_validation['error']}"}
+            item_id = str(item.get('id', index))
+            if item_id in item_ids:
+                return {"valid": False, "error": f"Item {index}: duplicate id '{item_id}'"}
+            item_ids.add(item_id)
+
+        return {"valid": True, "error": None}
+
+    @staticmethod
+    def validate_full_evaluation_batch_request(items: Any, image_count: int) -> Dict[str, Any]:
+        """Validate the items of a batch full evaluation, one per uploaded image"""
+        if not isinstance(items, list) or not items:
+            return {"valid": False, "error": "Field 'items' must be a non-empty JSON list"}
+
+        max_items = ValidationService.MAX_FULL_EVALUATION_BATCH_ITEMS
+        if len(items) > max_items:
+            return {
+                "valid": False,
+                "error": f"Too many items: {len(items)}. Maximum is {max_items}"
+            }
+
+        if len(items) != image_count:
+            return {
+                "valid": False,
+                "error": f"Got {len(items)} items for {image_count} images; send one 'images' file per item"
+            }
+
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                return {"valid": False, "error": f"Item {index}: must be an object"}
+            missing_fields = [
+                field for field in ValidationService.REQUIRED_FULL_EVALUATION_BATCH_FIELDS if not item.get(field)
+            ]
+            if missing_fields:
+                return {"valid": False, "error": f"Item {index}: Missing required fields: {', '.join(missing_fields)}"}
+
+        return {"valid": True, "error": None}
+
+
+# The evaluation service is built on first use, so importing this module never
+# constructs API clients or fails on a missing key.
+_math_service = None
+_math_service_lock = threading.Lock()
+
+def get_math_service() -> MathEvaluationService:
+    """Return the shared MathEvaluationService, creating it on first call."""
+    global _math_service
+    if _math_service is None:
+        with _math_service_lock:
+            if _math_service is None:
+                _math_service = MathEvaluationService()
+    return _math_service
 
-# Create service instances for use in other modules
-math_service = MathEvaluationService()
 validation_service = ValidationService()
@@ -0,0 +1,45 @@
+"""
+Tests for the semantic evaluation cache
+"""
+from cache import SemanticCache
+
+RESULT = {"success": True, "evaluation": "ok", "hint": "h", "verdict": "on track"}
+
+
+def test_hit_above_threshold_returns_copy():
+    cache = SemanticCache(threshold=0.95)
+    cache.put("problem", [1.0, 0.0], RESULT)
+    hit_id, similarity, result = cache.get("problem", [1.0, 0.01])
+    assert similarity > 0.95
+    assert result == RESULT and result is not RESULT
+    assert cache.get("other problem", [1.0, 0.0]) is None
+    assert cache.get("problem", [0.0, 1.0]) is None
+
+
+def test_feedback_moves_threshold_once_per_hit():
+    cache = SemanticCache(threshold=0.95, threshold_step=0.01)
+    cache.put("problem", [1.0, 0.0], RESULT)
+    hit_id, _, _ = cache.get("problem", [1.0, 0.0])
+    assert cache.record_feedback(hit_id, helpful=False)
+    assert cache.threshold == 0.96
+    assert not cache.record_feedback(hit_id, helpful=False)
+    assert not cache.record_feedback("unknown", helpful=True)
+
+
+def test_shared_store_accepts_feedback_from_another_worker(tmp_path):
+    serving = SemanticCache(threshold=0.95, threshold_step=0.01, directory=str(tmp_path))
+    other = SemanticCache(threshold=0.95, threshold_step=0.01, directory=str(tmp_path))
+    serving.put("problem", [1.0, 0.0], RESULT)
+    hit_id, _, _ = serving.get("problem", [1.0, 0.0])
+
+    assert other.record_feedback(hit_id, helpful=True)
+    assert serving.threshold == other.threshold == 0.94
+    assert not serving.record_feedback(hit_id, helpful=True)
+
+
+def test_threshold_stays_within_bounds():
+    cache = SemanticCache(threshold=0.999, max_threshold=0.999)
+    cache.put("problem", [1.0, 0.0], RESULT)
+    hit_id, _, _ = cache.get("problem", [1.0, 0.0])
+    cache.record_feedback(hit_id, helpful=False)
+    assert cache.threshold == 0.999
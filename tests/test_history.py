@@ -0,0 +1,43 @@
+"""
+Tests for trimming a session's history to the prompt window
+"""
+import pytest
+
+import services
+from services import _recent_history
+
+
+@pytest.fixture(autouse=True)
+def small_window(monkeypatch):
+    """Shrink the history window to 5 tokens (20 characters)."""
+    monkeypatch.setattr(services, 'HISTORY_MAX_TOKENS', 5)
+
+
+def test_short_history_is_unchanged():
+    history = "x + 1 = 5\nx = 4"
+    assert _recent_history(history) is history
+
+
+def test_history_at_the_limit_is_unchanged():
+    history = "a" * 20
+    assert _recent_history(history) == history
+
+
+def test_long_history_keeps_the_newest_whole_steps():
+    history = "step one: 2x = 8\nstep two: x = 4\nx=4"
+    assert _recent_history(history) == "(earlier steps omitted)\nstep two: x = 4\nx=4"
+
+
+def test_step_cut_by_the_window_is_dropped():
+    history = "step one: 2x = 8\nstep two: x = 4444\nx=4"
+    assert _recent_history(history) == "(earlier steps omitted)\nx=4"
+
+
+def test_single_long_step_is_cut_to_the_window():
+    history = "y" * 50
+    assert _recent_history(history) == "(earlier steps omitted)\n" + "y" * 20
+
+
+def test_non_string_history_is_passed_through():
+    assert _recent_history(None) is None
+    assert _recent_history(["x = 4"]) == ["x = 4"]
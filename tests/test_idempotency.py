@@ -0,0 +1,60 @@
+"""
+Tests for idempotent response replay
+"""
+import pytest
+
+import mathAI
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A test client with an empty response cache and a dummy OpenAI key."""
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    mathAI.response_cache._cache.clear()
+    return mathAI.app.test_client()
+
+
+def _evaluate(client, body, **headers):
+    """POST an evaluation that the router answers without a model call."""
+    return client.post('/api/evaluate', json=body, headers=headers)
+
+
+EXACT_MATCH = {"question": "Solve x + 1 = 5", "correct_answer": "x = 4", "student_answer": "x = 4"}
+
+
+def test_same_key_and_body_is_replayed(client):
+    assert _evaluate(client, EXACT_MATCH, **{"Idempotency-Key": "k1"}).headers['X-Cache'] == 'MISS'
+    replay = _evaluate(client, EXACT_MATCH, **{"Idempotency-Key": "k1"})
+    assert replay.status_code == 200
+    assert replay.headers['X-Cache'] == 'HIT'
+
+
+def test_reused_key_with_different_body_is_rejected(client):
+    _evaluate(client, EXACT_MATCH, **{"Idempotency-Key": "k2"})
+    response = _evaluate(client, {**EXACT_MATCH, "student_answer": "4"}, **{"Idempotency-Key": "k2"})
+    assert response.status_code == 422
+    assert response.json['success'] is False
+
+
+def test_key_is_scoped_to_the_client(client):
+    _evaluate(client, EXACT_MATCH, **{"Idempotency-Key": "k3", "Authorization": "Bearer a"})
+    other = _evaluate(client, EXACT_MATCH, **{"Idempotency-Key": "k3", "Authorization": "Bearer b"})
+    assert other.headers['X-Cache'] == 'MISS'
+
+
+def test_key_is_scoped_to_the_forwarded_client(client):
+    _evaluate(client, EXACT_MATCH, **{"Idempotency-Key": "k4", "X-Forwarded-For": "203.0.113.1"})
+    other = _evaluate(client, EXACT_MATCH, **{"Idempotency-Key": "k4", "X-Forwarded-For": "203.0.113.2"})
+    assert other.headers['X-Cache'] == 'MISS'
+
+
+def test_browsers_may_send_the_key_and_read_x_cache(client):
+    origin = {"Origin": "http://localhost:3000"}
+    preflight = client.options('/api/evaluate', headers=origin)
+    assert 'Idempotency-Key' in preflight.headers['Access-Control-Allow-Headers']
+    assert _evaluate(client, EXACT_MATCH, **origin).headers['Access-Control-Expose-Headers'] == 'X-Cache'
+
+
+def test_without_key_identical_bodies_are_replayed(client):
+    _evaluate(client, EXACT_MATCH)
+    assert _evaluate(client, EXACT_MATCH).headers['X-Cache'] == 'HIT'
@@ -0,0 +1,108 @@
+"""
+Tests for client-side rate limiting
+"""
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter, estimate_tokens
+
+
+class FakeClock:
+    """Monotonic clock that only advances when told to, or when a wait times out."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the limiter's clock so refill arithmetic is deterministic."""
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', fake.monotonic)
+    return fake
+
+
+def _waits(limiter, clock):
+    """Record each condition wait and advance the clock by its timeout instead of sleeping."""
+    waits = []
+
+    def wait(timeout):
+        waits.append(timeout)
+        clock.now += timeout
+
+    limiter._condition.wait = wait
+    return waits
+
+
+def test_estimate_tokens_is_a_quarter_of_the_characters():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("x" * 400) == 101
+
+
+def test_unlimited_limiter_never_waits(clock):
+    limiter = RateLimiter()
+    waits = _waits(limiter, clock)
+    for _ in range(100):
+        limiter.acquire(10_000)
+    assert waits == []
+
+
+def test_request_bucket_blocks_until_refilled(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    waits = _waits(limiter, clock)
+    for _ in range(60):
+        limiter.acquire(1)
+    assert waits == []
+
+    limiter.acquire(1)
+    assert waits == [pytest.approx(1.0)]
+
+
+def test_token_bucket_refills_in_proportion_to_elapsed_time(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+    waits = _waits(limiter, clock)
+    limiter.acquire(600)
+    clock.now += 30
+    limiter.acquire(300)
+    assert waits == []
+
+    limiter.acquire(100)
+    assert waits == [pytest.approx(10.0)]
+
+
+def test_oversized_request_waits_for_a_full_bucket_only(clock):
+    limiter = RateLimiter(tokens_per_minute=100)
+    waits = _waits(limiter, clock)
+    limiter.acquire(1_000)
+    assert waits == []
+
+
+def test_headers_set_limit_and_remaining_budget(clock):
+    limiter = RateLimiter()
+    waits = _waits(limiter, clock)
+    limiter.update_from_headers({
+        'x-ratelimit-limit-requests': '120',
+        'x-ratelimit-remaining-requests': '0',
+        'x-ratelimit-limit-tokens': '1000',
+        'x-ratelimit-remaining-tokens': '1000',
+    })
+    limiter.acquire(10)
+    assert waits == [pytest.approx(0.5)]
+
+
+def test_headers_never_raise_the_local_level(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+    waits = _waits(limiter, clock)
+    limiter.acquire(900)
+    limiter.update_from_headers({'x-ratelimit-limit-tokens': '1000', 'x-ratelimit-remaining-tokens': '1000'})
+    limiter.acquire(200)
+    assert waits == [pytest.approx(6.0)]
+
+
+def test_incomplete_headers_are_ignored(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    limiter.update_from_headers({'x-ratelimit-limit-requests': '1'})
+    assert limiter._requests.capacity == 60
@@ -0,0 +1,74 @@
+"""
+Tests for evaluation routing
+"""
+from router import EvaluationRouter, ROUTE_EXACT, ROUTE_FULL, ROUTE_LIGHT
+
+
+def _embed_with(vectors):
+    """Return an embedding function that answers with fixed vectors and records its input."""
+    calls = []
+
+    def embed(texts):
+        calls.append(texts)
+        return vectors
+
+    embed.calls = calls
+    return embed
+
+
+def test_exact_match_ignores_whitespace():
+    router = EvaluationRouter()
+    assert router.route(" 2x = 4 ", "2x=4") == ROUTE_EXACT
+
+
+def test_answers_differing_in_case_are_not_short_circuited():
+    router = EvaluationRouter()
+    assert router.route("2X=4", "2x=4") == ROUTE_FULL
+
+
+def test_numeric_answers_compare_as_text():
+    router = EvaluationRouter()
+    assert router.route(5, 5) == ROUTE_EXACT
+    assert router.route(5, "5") == ROUTE_EXACT
+    assert router.route(4, 5) == ROUTE_FULL
+
+
+def test_without_embeddings_everything_else_uses_full_model():
+    router = EvaluationRouter()
+    assert router.route("x = 3", "x = 4") == ROUTE_FULL
+
+
+def test_distant_answer_goes_to_light_model():
+    embed = _embed_with([[1.0, 0.0], [0.0, 1.0]])
+    router = EvaluationRouter(embed=embed, light_threshold=0.3)
+    assert router.route("I don't know", "x = 4") == ROUTE_LIGHT
+    assert embed.calls == [["I don't know", "x = 4"]]
+
+
+def test_similar_answer_is_never_accepted_as_correct():
+    router = EvaluationRouter(embed=_embed_with([[1.0, 0.0], [1.0, 0.0]]))
+    assert router.route("x = 3", "x = 4") == ROUTE_FULL
+
+
+def test_numeric_answers_are_embedded_as_text():
+    embed = _embed_with([[1.0, 0.0], [1.0, 0.0]])
+    EvaluationRouter(embed=embed).route(3, 4)
+    assert embed.calls == [["3", "4"]]
+
+
+def test_embedding_failure_uses_full_model():
+    router = EvaluationRouter(embed=lambda texts: None)
+    assert router.route("x = 3", "x = 4") == ROUTE_FULL
+
+
+def test_zero_vector_uses_light_model():
+    router = EvaluationRouter(embed=_embed_with([[0.0, 0.0], [1.0, 0.0]]))
+    assert router.route("", "x = 4") == ROUTE_LIGHT
+
+
+def test_counts_track_each_decision():
+    router = EvaluationRouter()
+    router.route("4", "4")
+    router.route("3", "4")
+    router.route("3", "4")
+    assert router.counts() == {ROUTE_EXACT: 1, ROUTE_LIGHT: 0, ROUTE_FULL: 2}
@@ -0,0 +1,52 @@
+"""
+Tests for request validation
+"""
+from services import ValidationService
+
+ITEM = {"question": "Solve x + 1 = 5", "correct_answer": "x = 4", "student_answer": "x = 3"}
+
+
+def test_batch_items_default_to_unique_index_ids():
+    result = ValidationService.validate_batch_evaluation_request({"items": [ITEM, ITEM]})
+    assert result == {"valid": True, "error": None}
+
+
+def test_batch_rejects_duplicate_ids():
+    items = [{**ITEM, "id": "a"}, {**ITEM, "id": "a"}]
+    result = ValidationService.validate_batch_evaluation_request({"items": items})
+    assert not result['valid']
+    assert "Item 1" in result['error']
+
+
+def test_batch_rejects_id_equal_to_another_items_index():
+    items = [ITEM, {**ITEM, "id": 0}]
+    result = ValidationService.validate_batch_evaluation_request({"items": items})
+    assert not result['valid']
+
+
+def test_batch_rejects_missing_fields():
+    result = ValidationService.validate_batch_evaluation_request({"items": [{"question": "q"}]})
+    assert result['error'] == "Item 0: Missing required fields: correct_answer, student_answer"
+
+
+def test_image_data_is_decoded_once_for_the_caller():
+    result = ValidationService.validate_image_data("data:image/png;base64,iVBORw0KGgo=")
+    assert result['valid']
+    assert result['decoded'] == b'\x89PNG\r\n\x1a\n'
+
+
+def test_image_data_rejects_invalid_base64():
+    assert not ValidationService.validate_image_data("not base64!")['valid']
+
+
+def test_full_evaluation_batch_needs_one_image_per_item():
+    items = [{"question": "q", "correct_answer": "a"}]
+    assert ValidationService.validate_full_evaluation_batch_request(items, 1)['valid']
+    result = ValidationService.validate_full_evaluation_batch_request(items, 2)
+    assert not result['valid']
+    assert "1 items for 2 images" in result['error']
+
+
+def test_full_evaluation_batch_rejects_missing_fields():
+    result = ValidationService.validate_full_evaluation_batch_request([{"question": "q"}], 1)
+    assert result['error'] == "Item 0: Missing required fields: correct_answer"